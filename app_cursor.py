@@ -1,28 +1,54 @@
 import streamlit as st
+import copy
 import datetime
 import re
 import pytz
 import os
+import sys
 import json
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
-from groq import Groq
+import math
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
 from dotenv import load_dotenv
-import requests
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
 from pathlib import Path
+from session_store import registry
+import event_store
+import oauth_flow
+import profiling
+from request_governor import BackendUnavailable, error_status, governor, single_flight
+import local_extraction
+from local_extraction import EMAIL_PATTERN, candidate_names
+
+# The Google client libraries, groq and smtplib are imported inside the
+# functions that use them. The landing page and the sign-in button need none
+# of them, and together they roughly double the cold-start import time.
 
 #print("Starting application...")
 
 # Load environment variables
 #load_dotenv('groqapi.env')
 
-# Initialize Groq client
-client = Groq(api_key=st.secrets['GROQ_API'])
-#client = Groq(api_key=os.environ['GROQ_API_KEY'])
+@st.cache_resource
+def get_groq_client():
+    """Groq client, created on first use and shared by every session and rerun"""
+    from groq import Groq
+    return Groq(api_key=st.secrets['GROQ_API'])
+    #return Groq(api_key=os.environ['GROQ_API_KEY'])
+
+def groq_completion(**kwargs):
+    """chat.completions.create through the request governor.
+
+    Identical prompts from the same user share one in-flight call.
+    """
+    key = json.dumps(kwargs, sort_keys=True, default=str)
+    return governor.call(
+        'groq',
+        lambda: get_groq_client().chat.completions.create(**kwargs),
+        user=st.session_state.get('user_email'),
+        key=key
+    )
 
 # Define scopes for Google APIs
 SCOPES = [
@@ -32,174 +58,462 @@ SCOPES = [
     'https://www.googleapis.com/auth/contacts.readonly'
 ]
 
-# Paths for credentials and token
+# OAuth client settings; signed-in users' credentials are kept in memory by session_store
 CREDENTIALS_FILE = "credentials.json"
-TOKEN_FILE = "token.json"
+# Longest the sign-in tab waits for the code-for-token exchange
+OAUTH_WAIT_SECONDS = 5
+# How often the signed-out page checks whether its sign-in tab has finished
+OAUTH_POLL_SECONDS = 2
+
+LOCAL_TIMEZONE = "America/New_York"
+DEFAULT_MEETING_MINUTES = 60
+
+class EventRecord:
+    """A calendar event reduced to the fields Alfie displays"""
+    __slots__ = ('date', 'time', 'summary', 'attendees', 'meet_link')
+
+    def __init__(self, date, time, summary, attendees=(), meet_link=None):
+        self.date = date
+        self.time = time
+        self.summary = summary
+        # Tuple of (name, email, is_self) with interned strings
+        self.attendees = attendees
+        self.meet_link = meet_link
+
+    @classmethod
+    def from_api(cls, event, local_tz):
+        """Build a record from a Calendar API event resource"""
+        start = event['start'].get('dateTime', event['start'].get('date'))
+        if 'T' in start:  # This is a datetime
+            start_dt = datetime.datetime.fromisoformat(start.replace('Z', '+00:00'))
+            local_dt = start_dt.astimezone(local_tz)
+            event_time = local_dt.strftime("%I:%M %p").lstrip('0')
+            event_date = local_dt.strftime("%m/%d/%Y")
+        else:  # This is a date
+            event_time = "All day"
+            event_date = start
+        attendees = tuple(
+            (sys.intern(a.get('displayName', 'No name')),
+             sys.intern(a.get('email', 'No email')),
+             a.get('self', False))
+            for a in event.get('attendees', [])
+        )
+        return cls(
+            event_date,
+            event_time,
+            sys.intern(event.get('summary', 'No event')),
+            attendees,
+            event.get('hangoutLink'),
+        )
+
+    def guests(self):
+        """Attendees other than the calendar owner, as (name, email) pairs"""
+        return [(name, email) for name, email, is_self in self.attendees if not is_self]
 
 def init_session_state():
-    print("Initializing session state...")
+    """Per-session state holds only small values and a handle into session_store"""
     if 'authenticated' not in st.session_state:
         st.session_state.authenticated = False
     if 'user_email' not in st.session_state:
         st.session_state.user_email = None
-    if 'calendar_service' not in st.session_state:
-        st.session_state.calendar_service = None
-    if 'contacts_service' not in st.session_state:
-        st.session_state.contacts_service = None
-    if 'contact_options' not in st.session_state:
-        st.session_state.contact_options = {}
+    if 'session_handle' not in st.session_state:
+        st.session_state.session_handle = None
     if 'needs_email' not in st.session_state:
         st.session_state.needs_email = None
     if 'selected_contact' not in st.session_state:
         st.session_state.selected_contact = None
-    print("Session state initialized")
-
-def authenticate_google():
-    creds = None
-    if os.path.exists(TOKEN_FILE):
-        creds = Credentials.from_authorized_user_file(TOKEN_FILE, SCOPES)
-    if not creds or not creds.valid:
-        if not os.path.exists(CREDENTIALS_FILE):
-            st.warning("Google OAuth credentials.json not found. Please enter your Google OAuth Client details.")
-            client_id = st.text_input("Client ID")
-            client_secret = st.text_input("Client Secret", type="password")
-            redirect_uris = st.text_area("Redirect URIs (comma separated)")
-            auth_uri = st.text_input("Auth URI", value="https://accounts.google.com/o/oauth2/auth")
-            token_uri = st.text_input("Token URI", value="https://oauth2.googleapis.com/token")
-            project_id = st.text_input("Project ID")
-            if st.button("Save Credentials and Authenticate"):
-                creds_dict = {
-                    "installed": {
-                        "client_id": client_id,
-                        "project_id": project_id,
-                        "auth_uri": auth_uri,
-                        "token_uri": token_uri,
-                        "client_secret": client_secret,
-                        "redirect_uris": [uri.strip() for uri in redirect_uris.split(",") if uri.strip()]
-                    }
+    if 'oauth_url' not in st.session_state:
+        st.session_state.oauth_url = None
+    if 'oauth_state' not in st.session_state:
+        st.session_state.oauth_state = None
+
+def current_user():
+    """Return the shared UserEntry (services and indexes) for this session.
+
+    If the registry evicted the session while it was idle, the session is
+    signed out so the user goes through sign-in again.
+    """
+    entry = registry.touch(st.session_state.session_handle)
+    if entry is None and st.session_state.authenticated:
+        st.session_state.authenticated = False
+        st.session_state.session_handle = None
+    return entry
+
+def profile_mode():
+    """Profiling mode for this run, or None.
+
+    ALFIE_PROFILE sets the default. When the server allows it
+    (ALFIE_PROFILE_QUERY=1), ?profile=1 (or sample/full) switches profiling
+    on for the session and ?profile=0 switches it off again.
+    """
+    if profiling.ALLOW_QUERY and 'profile' in st.query_params:
+        st.session_state.profile_mode = profiling.parse_mode(st.query_params['profile'])
+    return st.session_state.get('profile_mode', profiling.DEFAULT_MODE)
+
+@st.cache_resource
+def get_executor():
+    """Thread pool shared by all sessions for background lookups"""
+    return ThreadPoolExecutor(max_workers=8, thread_name_prefix="alfie")
+
+@profiling.staged('search_attendee')
+def speculate_attendees(user_input):
+    """Start contact lookups for likely names while parse_input is still running.
+
+    Nothing is started when the request contains an email (it is used
+    directly), looks like an events query, or the name is already resolved.
+    The lookups are shared single-flight calls, so names the LLM doesn't
+    confirm simply run to completion and fill the source cache.
+    """
+    input_lower = user_input.lower()
+    if re.search(EMAIL_PATTERN, user_input) or "events" in input_lower or "meetings" in input_lower:
+        return
+    entry = current_user()
+    if entry is None:
+        return
+    handle = st.session_state.session_handle
+    resolver = get_contact_resolver()
+    for name in candidate_names(user_input):
+        if not registry.has_index(handle, ('contacts', name.lower())):
+            resolver.prefetch(entry, handle, name)
+
+def load_client_config():
+    """OAuth client settings from credentials.json, asking for them if the file is missing"""
+    if not os.path.exists(CREDENTIALS_FILE):
+        st.warning("Google OAuth credentials.json not found. Please enter your Google OAuth Client details.")
+        client_id = st.text_input("Client ID")
+        client_secret = st.text_input("Client Secret", type="password")
+        redirect_uris = st.text_area("Redirect URIs (comma separated)", value=oauth_flow.REDIRECT_URI)
+        auth_uri = st.text_input("Auth URI", value="https://accounts.google.com/o/oauth2/auth")
+        token_uri = st.text_input("Token URI", value="https://oauth2.googleapis.com/token")
+        project_id = st.text_input("Project ID")
+        if st.button("Save Credentials and Authenticate"):
+            creds_dict = {
+                "web": {
+                    "client_id": client_id,
+                    "project_id": project_id,
+                    "auth_uri": auth_uri,
+                    "token_uri": token_uri,
+                    "client_secret": client_secret,
+                    "redirect_uris": [uri.strip() for uri in redirect_uris.split(",") if uri.strip()]
                 }
-                with open(CREDENTIALS_FILE, 'w') as f:
-                    json.dump(creds_dict, f)
-                st.success("credentials.json created. Please click Authenticate again.")
-                st.stop()
-        flow = InstalledAppFlow.from_client_secrets_file(CREDENTIALS_FILE, SCOPES)
-        creds = flow.run_local_server(port=0)
-        with open(TOKEN_FILE, 'w') as token:
-            token.write(creds.to_json())
-    return creds
-
-def get_contact_suggestions(contacts_service, query):
-    """Get contact suggestions based on the query, focusing on email contacts only"""
+            }
+            with open(CREDENTIALS_FILE, 'w') as f:
+                json.dump(creds_dict, f)
+            st.success("credentials.json created. Please click Authenticate again.")
+        st.stop()
+    with open(CREDENTIALS_FILE) as f:
+        return json.load(f)
+
+def sign_in_url():
+    """Google consent URL for this session, kept for its reruns until its state expires.
+
+    None, after explaining why, if credentials.json can't be used.
+    """
+    if not st.session_state.oauth_url or not oauth_flow.logins.is_pending(st.session_state.oauth_state):
+        try:
+            url, state = oauth_flow.logins.start(load_client_config(), SCOPES)
+        except (OSError, ValueError, oauth_flow.LoginError) as e:
+            st.error(f"Google sign-in isn't set up correctly ({CREDENTIALS_FILE}): {e}")
+            return None
+        st.session_state.oauth_url = url
+        st.session_state.oauth_state = state
+    return st.session_state.oauth_url
+
+def per_thread_requests(credentials):
+    """requestBuilder for build() that gives each thread its own HTTP connection.
+
+    httplib2.Http isn't thread-safe, and a user's services are shared by all
+    of their tabs and by the executor's contact lookups and history syncs,
+    so requests can't all go through the one connection build() would
+    attach to the service.
+    """
+    import google_auth_httplib2
+    import httplib2
+    from googleapiclient.http import HttpRequest
+    local = threading.local()
+
+    def build_request(http, *args, **kwargs):
+        if getattr(local, 'http', None) is None:
+            local.http = google_auth_httplib2.AuthorizedHttp(credentials, http=httplib2.Http())
+        return HttpRequest(local.http, *args, **kwargs)
+    return build_request
+
+def open_google_session(credentials, email):
+    """Register the signed-in user's Google services and mark the session signed in"""
+    import google_auth_httplib2
+    import httplib2
+    from googleapiclient.discovery import build
+
+    def service(name, version):
+        return build(name, version, requestBuilder=per_thread_requests(credentials),
+                     http=google_auth_httplib2.AuthorizedHttp(credentials, http=httplib2.Http()))
+    # Every Google call made for this user goes through the governor
+    st.session_state.session_handle = registry.open_session(
+        email,
+        governor.govern(service("calendar", "v3"), 'google', email),
+        governor.govern(service("people", "v1"), 'google', email)
+    )
+    st.session_state.user_email = email
+    st.session_state.authenticated = True
+    st.session_state.oauth_url = None
+    st.session_state.oauth_state = None
+
+def finish_sign_in(state, code):
+    """Handle Google's redirect back to the app (?code=...&state=...) in the sign-in tab.
+
+    The tokens go to the session that started the sign-in, never to this
+    one, so a forged redirect can't sign this browser in as someone else.
+    """
+    st.query_params.clear()
+    try:
+        future = oauth_flow.logins.complete(state, code, get_executor())
+        # The exchange runs on the shared executor; this only waits for it
+        with st.spinner("Signing you in..."):
+            future.result(timeout=OAUTH_WAIT_SECONDS)
+    except FuturesTimeoutError:
+        st.info("Still talking to Google. Go back to the Alfie tab you signed in from; it will finish there.")
+    except Exception as e:
+        st.error(f"Authentication failed: {e}")
+    else:
+        st.success("You're signed in. Go back to the Alfie tab you signed in from; you can close this one.")
+
+@st.fragment(run_every=OAUTH_POLL_SECONDS)
+def wait_for_sign_in():
+    """Pick up this session's sign-in once Google has redirected the other tab back"""
+    state = st.session_state.oauth_state
+    if state and not oauth_flow.logins.is_pending(state):
+        # Too long on the landing page: the button's link would be refused,
+        # so the page is redrawn with a fresh one
+        st.session_state.oauth_url = None
+        st.session_state.oauth_state = None
+        st.rerun(scope="app")
+    future = oauth_flow.logins.claim(state) if state else None
+    if future is None or not future.done():
+        return
+    oauth_flow.logins.forget(state)
+    st.session_state.oauth_url = None
+    st.session_state.oauth_state = None
+    try:
+        credentials, email = future.result()
+    except Exception as e:
+        st.error(f"Authentication failed: {e}")
+        return
+    open_google_session(credentials, email)
+    st.rerun(scope="app")
+
+# Candidates found in the user's own contacts beat the directory, which beats
+# people only seen in meeting history
+SOURCE_WEIGHTS = {'contacts': 0.3, 'directory': 0.2, 'calendar': 0.0}
+SOURCE_ICONS = {'contacts': "📧", 'directory': "👥", 'calendar': "📅"}
+# Meeting recency halves in weight every this many days
+RECENCY_HALF_LIFE_DAYS = 60
+
+class ContactCandidate:
+    """One person a name could refer to, merged across every source"""
+    __slots__ = ('email', 'name', 'sources', 'count', 'last_date', 'score')
+
+    def __init__(self, email, name):
+        self.email = email
+        self.name = name
+        self.sources = ()
+        self.count = 0
+        self.last_date = ''
+        self.score = 0.0
+
+    def label(self):
+        icon = SOURCE_ICONS[self.sources[0]] if self.sources else ""
+        label = f"{icon} {self.name} ({self.email})"
+        if self.count:
+            label += f" - {self.count} meetings"
+        return label
+
+def name_match_quality(query, name, email):
+    """How well a display name (or email) matches what the user typed, 0..1"""
+    query = query.lower().strip()
+    name = name.lower()
+    if not query:
+        return 0.0
+    if name == query:
+        return 1.0
+    tokens = re.split(r"[\s.\-_']+", name)
+    if query in tokens:
+        return 0.8
+    if any(token.startswith(query) for token in tokens):
+        return 0.6
+    if query in name:
+        return 0.4
+    if query.replace(' ', '') in email.lower().split('@')[0]:
+        return 0.3
+    return 0.0
+
+def fetch_directory(contacts_service, query):
+    """(name, email) pairs from the Workspace directory for query"""
     try:
-        # Search in user's contacts
         results = contacts_service.people().searchDirectoryPeople(
             query=query,
             readMask='names,emailAddresses',
             sources=['DIRECTORY_SOURCE_TYPE_DOMAIN_PROFILE', 'DIRECTORY_SOURCE_TYPE_DOMAIN_CONTACT'],
             pageSize=10
         ).execute()
-        
-        # Also search in user's connections
-        connections = contacts_service.people().connections().list(
-            resourceName='people/me',
-            pageSize=100,
-            personFields='names,emailAddresses',
-            sortOrder='LAST_MODIFIED_DESCENDING'
-        ).execute()
-        
-        contacts = []
-        
-        # Process directory search results
-        if 'people' in results:
-            for person in results['people']:
-                if 'emailAddresses' in person and 'names' in person:
-                    name = person['names'][0].get('displayName', '')
-                    email = person['emailAddresses'][0].get('value', '')
-                    if email and query.lower() in name.lower():
-                        contacts.append({
-                            'name': name,
-                            'email': email,
-                            'source': 'directory'
-                        })
-        
-        # Process connections (personal contacts)
-        if 'connections' in connections:
-            for person in connections['connections']:
-                if 'emailAddresses' in person and 'names' in person:
-                    name = person['names'][0].get('displayName', '')
-                    email = person['emailAddresses'][0].get('value', '')
-                    if email and query.lower() in name.lower():
-                        contacts.append({
-                            'name': name,
-                            'email': email,
-                            'source': 'contacts'
-                        })
-        
-        # Search in calendar history
-        calendar_service = st.session_state.calendar_service
-        events_result = calendar_service.events().list(
-            calendarId='primary',
-            maxResults=100,
-            singleEvents=True,
-            orderBy='startTime'
-        ).execute()
-        
-        # Extract unique attendees from past events
-        past_contacts = set()
-        for event in events_result.get('items', []):
-            attendees = event.get('attendees', [])
-            for attendee in attendees:
-                email = attendee.get('email', '')
-                name = attendee.get('displayName', email.split('@')[0])
-                if email and query.lower() in name.lower():
-                    past_contacts.add((name, email))
-        
-        # Add past contacts to suggestions
-        for name, email in past_contacts:
-            if not any(c['email'] == email for c in contacts):
-                contacts.append({
-                    'name': name,
-                    'email': email,
-                    'source': 'calendar'
-                })
-        
-        # Sort contacts by relevance
-        # Priority: exact matches first, then starts with, then contains
-        def sort_key(contact):
-            name = contact['name'].lower()
-            query_lower = query.lower()
-            if name == query_lower:
-                return (0, name)
-            elif name.startswith(query_lower):
-                return (1, name)
-            else:
-                return (2, name)
-        
-        contacts.sort(key=sort_key)
-        
-        # Remove duplicates while preserving order
-        seen_emails = set()
-        unique_contacts = []
-        for contact in contacts:
-            if contact['email'] not in seen_emails:
-                seen_emails.add(contact['email'])
-                unique_contacts.append(contact)
-        
-        return unique_contacts[:10]  # Limit to top 10 results
     except Exception as e:
-        st.error(f"Error searching contacts: {e}")
-        return []
+        # Accounts outside Google Workspace have no directory; that is an
+        # answer, not a failure worth retrying
+        if error_status(e) in (400, 403, 404):
+            return []
+        raise
+    return _people_pairs(results.get('people', []))
 
-def get_previous_attendee(calendar_service, name):
-    """Search for attendee in previous calendar events and return the email directly"""
-    options = search_attendee(calendar_service, name)
-    
-    if options and len(options) > 0:
-        # Return the first email by default
-        return options[0][0]
-    
-    # If no previous attendee found, return a placeholder
-    return f"{name.lower().replace(' ', '')}@example.com"
+def fetch_connections(contacts_service):
+    """(name, email) pairs for all of the user's personal contacts"""
+    connections = contacts_service.people().connections().list(
+        resourceName='people/me',
+        pageSize=1000,
+        personFields='names,emailAddresses',
+        sortOrder='LAST_MODIFIED_DESCENDING'
+    ).execute()
+    return _people_pairs(connections.get('connections', []))
+
+def _people_pairs(people):
+    pairs = []
+    for person in people:
+        if 'emailAddresses' in person and 'names' in person:
+            name = person['names'][0].get('displayName', '')
+            email = person['emailAddresses'][0].get('value', '')
+            if email:
+                pairs.append((sys.intern(name), sys.intern(email)))
+    return pairs
+
+def rank_candidates(query, directory, connections, history, now=None):
+    """Merge all sources into one list of ContactCandidate, best first.
+
+    The score combines name match quality, how often and how recently the
+    user met the person, and which sources know about them.
+    """
+    candidates = {}
+
+    def add(name, email, source):
+        candidate = candidates.get(email)
+        if candidate is None:
+            candidate = candidates[email] = ContactCandidate(email, name)
+        if source not in candidate.sources:
+            candidate.sources += (source,)
+        return candidate
+
+    for name, email in connections:
+        if name_match_quality(query, name, email):
+            add(name, email, 'contacts')
+    for name, email in directory:
+        if name_match_quality(query, name, email):
+            add(name, email, 'directory')
+    for record in history.values():
+        if name_match_quality(query, record.name, record.email):
+            candidate = add(record.name, record.email, 'calendar')
+            candidate.count = record.count
+            candidate.last_date = record.last_date
+
+    if now is None:
+        now = datetime.datetime.now(datetime.timezone.utc)
+    max_count = max((c.count for c in candidates.values()), default=0)
+    for candidate in candidates.values():
+        match = max(name_match_quality(query, candidate.name, candidate.email), 0.0)
+        frequency = math.log1p(candidate.count) / math.log1p(max_count) if max_count else 0.0
+        recency = 0.0
+        if candidate.last_date:
+            try:
+                last = datetime.datetime.fromisoformat(candidate.last_date.replace('Z', '+00:00'))
+                if last.tzinfo is None:
+                    last = last.replace(tzinfo=datetime.timezone.utc)
+                days = max((now - last).total_seconds() / 86400, 0)
+                recency = 0.5 ** (days / RECENCY_HALF_LIFE_DAYS)
+            except ValueError:
+                pass
+        source_bonus = sum(SOURCE_WEIGHTS[source] for source in candidate.sources)
+        candidate.score = 3 * match + 2 * frequency + 1.5 * recency + source_bonus
+        # Show the most trusted source's icon
+        candidate.sources = tuple(sorted(candidate.sources, key=lambda src: -SOURCE_WEIGHTS[src]))
+
+    return sorted(candidates.values(), key=lambda c: (-c.score, c.name.lower()))
+
+_MISSING = object()
+
+class ContactResolver:
+    """Single lookup path for attendee names.
+
+    Directory search, the user's connections and their meeting history are
+    fetched concurrently. The connections list is a per-user index in
+    session_store, shared by every name and every session; meeting history
+    is an indexed query on the user's event store. The ranked answer for
+    each name is cached in session_store too, once every source has
+    answered, so a name is resolved once and reruns reuse the decision.
+    """
+
+    def __init__(self, executor):
+        self._executor = executor
+
+    def _source(self, entry, handle, key, fetch):
+        """Future for a source index: cached, already in flight, or newly started"""
+        value = registry.lookup_index(handle, key, _MISSING)
+        if value is not _MISSING:
+            future = Future()
+            future.set_result(value)
+            return future
+        return single_flight.submit(('index', entry.email, key), self._executor,
+                                    profiling.bind(lambda: self._fetch(handle, key, fetch)))
+
+    def _fetch(self, handle, key, fetch):
+        value = fetch()
+        registry.put_index(handle, key, value)
+        return value
+
+    def _sources(self, entry, handle, name):
+        return {
+            'directory': self._source(entry, handle, ('directory', name.lower()),
+                                      lambda: fetch_directory(entry.contacts_service, name)),
+            'connections': self._source(entry, handle, ('connections',),
+                                        lambda: fetch_connections(entry.contacts_service)),
+            'history': self._source(entry, handle, ('history', name.lower()),
+                                    lambda: attendee_history(entry.calendar_service, entry.email, name)),
+        }
+
+    def prefetch(self, entry, handle, name):
+        """Start every source for name without waiting"""
+        self._sources(entry, handle, name)
+
+    def resolve(self, entry, handle, name):
+        """Ranked ContactCandidate list for name"""
+        key = ('contacts', name.lower())
+        cached = registry.lookup_index(handle, key, _MISSING)
+        if cached is not _MISSING:
+            return cached
+        results = {}
+        complete = True
+        for source, future in self._sources(entry, handle, name).items():
+            try:
+                results[source] = future.result()
+            except Exception as e:
+                # Directory search fails for non-Workspace accounts; other
+                # sources still give an answer
+                print(f"Contact source {source} failed for {name!r}: {e}")
+                results[source] = {} if source == 'history' else []
+                complete = False
+        candidates = rank_candidates(name, results['directory'], results['connections'], results['history'])[:10]
+        # A ranking missing a source is used for this run only, so the next
+        # run retries the failed source instead of reusing the partial answer
+        if complete:
+            registry.put_index(handle, key, candidates)
+        return candidates
+
+@st.cache_resource
+def get_contact_resolver():
+    return ContactResolver(get_executor())
+
+@profiling.staged('search_attendee')
+def resolve_contacts(name):
+    """Ranked contact candidates for name, for the current session's user"""
+    entry = current_user()
+    if entry is None:
+        return []
+    return get_contact_resolver().resolve(entry, st.session_state.session_handle, name)
 
 def parse_attendees(attendees_input):
     """Parse multiple attendees from input string or list"""
@@ -213,37 +527,13 @@ def parse_attendees(attendees_input):
         # If it's neither, return empty list
         return []
 
-def get_contact_email(contacts_service, name):
-    """Enhanced version to get contact email with suggestions"""
-    contacts = get_contact_suggestions(contacts_service, name)
-    if contacts:
-        # If only one contact found, return it directly
-        if len(contacts) == 1:
-            return contacts[0]['email']
-        
-        # If multiple contacts found, let user choose
-        options = []
-        for contact in contacts:
-            source_icon = "📧" if contact['source'] == 'contacts' else "👥" if contact['source'] == 'directory' else "📅"
-            option = f"{source_icon} {contact['name']} ({contact['email']})"
-            options.append(option)
-        
-        selected = st.selectbox(
-            f"Multiple contacts found for '{name}'. Please select:",
-            options,
-            help="📧: Personal Contact | 👥: Directory | 📅: Calendar History"
-        )
-        
-        if selected:
-            email = selected.split('(')[-1].rstrip(')')
-            return email
-    return None
-
 def normalize_time(time_str):
     """
     Convert various time formats to a standard format for comparison.
     Handles formats like: 2pm, 2:00pm, 2:00 PM, 14:00, etc.
     """
+    if not time_str:
+        return None
     # Remove any spaces and convert to lowercase
     time_str = time_str.lower().replace(" ", "")
     
@@ -267,8 +557,126 @@ def normalize_time(time_str):
     except:
         return None
 
-def check_calendar(calendar_service, specific_date=None, specific_time=None):
-    """Check calendar events for a specific date and time"""
+# A cached day is served without any request for this long...
+DAY_CACHE_FRESH_SECONDS = 60
+# ...then refreshed with an updatedMin delta, until it is this old and gets
+# refetched in full (a delta can't see events moved to another day)
+DAY_CACHE_FULL_REFRESH_SECONDS = 15 * 60
+DAY_CACHE_MAX_BUCKETS = 5000
+
+def _event_sort_key(event):
+    start = event['start']
+    if 'dateTime' in start:
+        return (1, datetime.datetime.fromisoformat(start['dateTime'].replace('Z', '+00:00')).timestamp())
+    return (0, 0.0)  # All-day events first
+
+class DayBucket:
+    """One user's events for one calendar and one local day"""
+    __slots__ = ('events', 'synced_at', 'checked_at')
+
+    def __init__(self):
+        self.events = {}  # event id -> (sort key, EventRecord)
+        self.synced_at = 0.0   # last full fetch
+        self.checked_at = 0.0  # last full or delta fetch
+
+    def apply(self, items, local_tz):
+        for event in items:
+            if event.get('status') == 'cancelled':
+                self.events.pop(event.get('id'), None)
+            else:
+                self.events[event.get('id')] = (_event_sort_key(event), EventRecord.from_api(event, local_tz))
+
+    def records(self):
+        return [record for _, record in sorted(self.events.values(), key=lambda item: item[0])]
+
+class DayEventCache:
+    """Formatted events bucketed by (user, calendar, local date).
+
+    Repeated "show my events" questions are answered from the bucket. Once
+    it is older than DAY_CACHE_FRESH_SECONDS only events updated since the
+    last fetch are requested (updatedMin + showDeleted), and booking an
+    event updates its bucket in place.
+    """
+
+    def __init__(self, max_buckets=DAY_CACHE_MAX_BUCKETS):
+        self.max_buckets = max_buckets
+        self._lock = threading.Lock()
+        self._buckets = OrderedDict()
+
+    def get_day(self, calendar_service, user_email, calendar_id, day, time_min, time_max,
+                max_age=DAY_CACHE_FRESH_SECONDS):
+        """EventRecords for day, fetching only what changed since the last call"""
+        key = (user_email, calendar_id, day)
+        now = time.time()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is not None:
+                self._buckets.move_to_end(key)
+                if now - bucket.checked_at < max_age:
+                    return bucket.records()
+        local_tz = pytz.timezone(LOCAL_TIMEZONE)
+        request = dict(calendarId=calendar_id, timeMin=time_min, timeMax=time_max,
+                       maxResults=250, singleEvents=True, orderBy='startTime')
+        full = bucket is None or now - bucket.synced_at > DAY_CACHE_FULL_REFRESH_SECONDS
+        if not full:
+            # Allow for clock skew between us and Google
+            since = datetime.datetime.fromtimestamp(bucket.checked_at - 60, datetime.timezone.utc)
+            request.update(updatedMin=since.isoformat().replace('+00:00', 'Z'), showDeleted=True)
+        result = calendar_service.events().list(**request).execute()
+        with self._lock:
+            if full:
+                bucket = DayBucket()
+                bucket.synced_at = now
+                self._buckets[key] = bucket
+                while len(self._buckets) > self.max_buckets:
+                    self._buckets.popitem(last=False)
+            bucket.apply(result.get('items', []), local_tz)
+            bucket.checked_at = now
+            return bucket.records()
+
+    def add_event(self, user_email, calendar_id, event):
+        """Put a just-created event into its day's bucket, if that day is cached"""
+        local_tz = pytz.timezone(LOCAL_TIMEZONE)
+        start = event['start'].get('dateTime')
+        if start:
+            day = datetime.datetime.fromisoformat(start.replace('Z', '+00:00')).astimezone(local_tz).strftime("%Y-%m-%d")
+        else:
+            day = event['start'].get('date')
+        with self._lock:
+            bucket = self._buckets.get((user_email, calendar_id, day))
+            if bucket is not None:
+                bucket.apply([event], local_tz)
+
+    def drop_user(self, user_email):
+        """Forget every cached day of user_email, e.g. when they sign out"""
+        with self._lock:
+            for key in [key for key in self._buckets if key[0] == user_email]:
+                del self._buckets[key]
+
+@st.cache_resource
+def get_day_cache():
+    return DayEventCache()
+
+def get_event_store(calendar_service, user_email, max_age=DAY_CACHE_FRESH_SECONDS):
+    """The user's event store, synced first if it is older than max_age seconds"""
+    store = event_store.stores.get(user_email, pytz.timezone(LOCAL_TIMEZONE))
+    store.sync(calendar_service, "primary", max_age)
+    return store
+
+def attendee_history(calendar_service, user_email, name):
+    """email -> AttendeeStats for people matching name the user met in the last year"""
+    store = get_event_store(calendar_service, user_email)
+    now = time.time()
+    return {stats.email: stats for stats in store.find_attendees(name, now - 365 * 86400, now)}
+
+@profiling.staged('check_calendar')
+def check_calendar(calendar_service, specific_date=None, specific_time=None, user_email=None,
+                   max_age=DAY_CACHE_FRESH_SECONDS):
+    """Check calendar events for a specific date and time.
+
+    With a user_email, events are read from the user's synced event store;
+    days outside its window go through the shared day cache.
+    """
     try:
         # Convert specific_date to datetime
         if specific_date:
@@ -298,7 +706,7 @@ def check_calendar(calendar_service, specific_date=None, specific_time=None):
                 end_of_day = date_obj.replace(hour=23, minute=59, second=59, microsecond=999999)
                 
                 # Convert to UTC
-                timezone = pytz.timezone("America/New_York")
+                timezone = pytz.timezone(LOCAL_TIMEZONE)
                 start_of_day = timezone.localize(start_of_day).astimezone(pytz.UTC)
                 end_of_day = timezone.localize(end_of_day).astimezone(pytz.UTC)
                 
@@ -311,68 +719,64 @@ def check_calendar(calendar_service, specific_date=None, specific_time=None):
             timeMin = datetime.datetime.utcnow().isoformat() + 'Z'
             timeMax = None
         
-        events_result = calendar_service.events().list(
-            calendarId="primary",
-            timeMin=timeMin,
-            timeMax=timeMax,
-            maxResults=20,
-            singleEvents=True,
-            orderBy='startTime'
-        ).execute()
+        local_tz = pytz.timezone(LOCAL_TIMEZONE)
+        store = get_event_store(calendar_service, user_email, max_age) if user_email else None
+        if specific_date and store and store.covers("primary", start_of_day.timestamp(), end_of_day.timestamp()):
+            events = store.events_between("primary", start_of_day.timestamp(), end_of_day.timestamp())
+            records = [EventRecord.from_api(event, local_tz) for event in events]
+        elif specific_date and user_email:
+            # Days outside the synced window are fetched through the day cache
+            records = get_day_cache().get_day(
+                calendar_service, user_email, "primary", date_obj.strftime("%Y-%m-%d"),
+                timeMin, timeMax, max_age=max_age
+            )
+        elif store:
+            events = store.events_between("primary", time.time(), float('inf'), limit=20)
+            records = [EventRecord.from_api(event, local_tz) for event in events]
+        else:
+            events_result = calendar_service.events().list(
+                calendarId="primary",
+                timeMin=timeMin,
+                timeMax=timeMax,
+                maxResults=20,
+                singleEvents=True,
+                orderBy='startTime'
+            ).execute()
+            local_tz = pytz.timezone(LOCAL_TIMEZONE)
+            records = [EventRecord.from_api(event, local_tz) for event in events_result.get('items', [])]
         
-        events = events_result.get('items', [])
         event_list = []
         has_conflict = False
         conflict_details = None
         
-        for event in events:
-            start = event['start'].get('dateTime', event['start'].get('date'))
-            
-            # Convert to local time
-            if 'T' in start:  # This is a datetime
-                start_dt = datetime.datetime.fromisoformat(start.replace('Z', '+00:00'))
-                local_tz = pytz.timezone("America/New_York")
-                local_dt = start_dt.astimezone(local_tz)
-                event_time = local_dt.strftime("%I:%M %p").lstrip('0')
-                event_date = local_dt.strftime("%m/%d/%Y")
-                
-                # Check for conflict if specific_time is provided
-                if specific_time:
-                    normalized_time = normalize_time(specific_time)
-                    event_time_24 = local_dt.strftime("%H:%M")
-                    if normalized_time == event_time_24:
-                        has_conflict = True
-                        conflict_details = {
-                            "time": event_time,
-                            "summary": event['summary'],
-                            "attendees": [attendee.get('email', '') for attendee in event.get('attendees', [])]
-                        }
-            else:  # This is a date
-                event_time = "All day"
-                event_date = start
-            
-            attendees = event.get('attendees', [])
-            attendee_list = [f"{a.get('displayName', 'No name')} ({a.get('email', 'No email')})" 
-                           for a in attendees if not a.get('self', False)]
+        for record in records:
+            # Check for conflict if specific_time is provided
+            if specific_time and record.time != "All day":
+                if normalize_time(specific_time) == normalize_time(record.time):
+                    has_conflict = True
+                    conflict_details = {
+                        "time": record.time,
+                        "summary": record.summary,
+                        "attendees": [email for _, email, _ in record.attendees]
+                    }
             
-            event_list.append({
-                "date": event_date,
-                "time": event_time,
-                "event": event['summary'],
-                "attendees": attendees,
-                "meet_link": event.get('hangoutLink', 'No meet link')
-            })
+            event_list.append(record)
         
         return event_list, has_conflict, conflict_details
     except Exception as e:
         st.error(f"Error checking calendar: {e}")
         return [], False, None
 
-def book_appointment(calendar_service, date, time, attendees, summary="Meeting"):
-    timezone = "America/New_York"
+@profiling.staged('book_appointment')
+def book_appointment(calendar_service, date, time, attendees, summary="Meeting", user_email=None,
+                     duration=DEFAULT_MEETING_MINUTES):
+    timezone = LOCAL_TIMEZONE
+    
+    if not date:
+        return "❌ No date found. Please say which day, e.g. 'tomorrow' or '04/08/2026'"
     
-    # First check for conflicts
-    events, has_conflict, conflict_details = check_calendar(calendar_service, date, time)
+    # First check for conflicts (always revalidating a cached day)
+    events, has_conflict, conflict_details = check_calendar(calendar_service, date, time, user_email, max_age=0)
     
     if has_conflict:
         conflict_message = f"""
@@ -395,7 +799,7 @@ def book_appointment(calendar_service, date, time, attendees, summary="Meeting")
     
     start_datetime = datetime.datetime.strptime(f"{date} {display_time}", "%m/%d/%Y %I:%M %p")
     start_datetime = pytz.timezone(timezone).localize(start_datetime)
-    end_datetime = start_datetime + datetime.timedelta(hours=1)
+    end_datetime = start_datetime + datetime.timedelta(minutes=duration)
     
     # Format attendees for the event
     formatted_attendees = [{'email': email} for email in attendees if email]
@@ -422,6 +826,11 @@ def book_appointment(calendar_service, date, time, attendees, summary="Meeting")
             sendUpdates='all'
         ).execute()
         
+        if user_email:
+            # Show the new meeting in the store and cached day views without a re-fetch
+            event_store.stores.get(user_email, pytz.timezone(timezone)).apply("primary", [event])
+            get_day_cache().add_event(user_email, "primary", event)
+        
         # Get the meeting link
         meet_link = event.get('hangoutLink', '')
         
@@ -430,12 +839,24 @@ def book_appointment(calendar_service, date, time, attendees, summary="Meeting")
     except Exception as e:
         return f"❌ Error creating event: {str(e)}"
 
+@profiling.staged('parse_input')
 def parse_input(user_input, today):
-    """Extract meeting details from user input"""
+    """Extract meeting details from user input.
+
+    Identical requests from the same user (two tabs, or quick reruns) share
+    one parse while it is in flight.
+    """
+    user_input = " ".join(user_input.split())
+    key = ('parse_input', st.session_state.get('user_email'), user_input, today)
+    result = single_flight.do(key, lambda: _parse_input(user_input, today))
+    # Callers annotate the result, so each gets its own copy
+    return copy.deepcopy(result)
+
+def _parse_input(user_input, today):
     # First check if it's an events query
     input_lower = user_input.lower()
     
-    # Handle events queries
+    # "today" and "tomorrow" event lookups don't need the model at all
     if "events" in input_lower or "meetings" in input_lower:
         if "today" in input_lower:
             return {
@@ -450,78 +871,241 @@ def parse_input(user_input, today):
                 "date": tomorrow,
                 "query_type": "tomorrow"
             }
-        elif "on" in input_lower or "for" in input_lower:
-            # Try to extract date from the query
-            chat_completion = client.chat.completions.create(
-                messages=[
-                    {"role": "system", "content": "Extract date from the text. If only month and day are provided (like 'April 8th'), assume it's for the current year and return in MM/DD/YYYY format. Return only the date."},
-                    {"role": "user", "content": user_input}
-                ],
-                model="llama-3.3-70b-versatile",
-                temperature=0.5,
-                top_p=1,
-                stream=False
-            )
-            extracted_date = chat_completion.choices[0].message.content.strip()
-            
-            # Check if year is missing and add current year if needed
-            if re.match(r'^\d{1,2}/\d{1,2}$', extracted_date):
-                current_year = datetime.datetime.now().year
-                extracted_date = f"{extracted_date}/{current_year}"
-            
-            return {
-                "type": "events_query",
-                "date": extracted_date,
-                "query_type": "specific_date"
-            }
-    
-    # Handle meeting scheduling
-    # Check for email in the input
-    email_pattern = r'[\w\.-]+@[\w\.-]+\.\w+'
-    found_email = re.search(email_pattern, user_input)
     
-    # Modify the system prompt to better handle multiple attendees
-    chat_completion = client.chat.completions.create(
+    # Everything else is classified and extracted in one pass
+    fields = get_extraction_backend(EXTRACTION_MODE).extract(user_input, today)
+    return shape_extraction(fields, user_input, today)
+
+# One structured-output call classifies the request and pulls out every
+# field. Keys are short to keep both the prompt and the reply small.
+EXTRACTION_FIELDS = (
+    '{"intent":"events" or "meeting","date":"MM/DD/YYYY","end_date":"MM/DD/YYYY" or null,'
+    '"time":"2pm" or null,"minutes":int or null,"people":[names or emails],"summary":str or null}'
+)
+EXTRACTION_PROMPT = (
+    "Read a calendar request. Reply with JSON only: " + EXTRACTION_FIELDS +
+    ". end_date only for a range of days. A date without a year is in the current year."
+)
+BATCH_EXTRACTION_PROMPT = (
+    'Read several calendar requests, given as a JSON list of {"id","today","text"}. '
+    'Reply with JSON only: {"results":[...]} holding, for each request, its "id" plus ' +
+    EXTRACTION_FIELDS + ". end_date only for a range of days. A date without a year is in the current year."
+)
+EXTRACTION_MODEL = "llama-3.3-70b-versatile"
+# Extraction requests arriving within this many milliseconds of each other
+# share one Groq call; 0 sends each request on its own
+EXTRACTION_BATCH_MS = float(os.environ.get("ALFIE_EXTRACTION_BATCH_MS", "0"))
+EXTRACTION_MAX_BATCH = 8
+
+def extract_request(user_input, today):
+    """Classify one request and extract its fields with a single Groq call"""
+    chat_completion = groq_completion(
         messages=[
-            {
-                "role": "system", 
-                "content": """Extract meeting details from the text. For multiple attendees, return them as a list.
-                If an email is found, use it directly. Format names consistently."""
-            },
-            {
-                "role": "user", 
-                "content": f"""Extract meeting details from: '{user_input}' and today's date {today}. 
-                Return a JSON object with: 
-                - 'Person' (name or email, if multiple names return as list), 
-                - 'date' (MM/DD/YYYY), 
-                - 'time', 
-                - 'email' (if found in input), 
-                - 'summary'. 
-                Example for multiple people: "Person": ["John", "Sarah"]
-                **NOTE - only return json object no other text"""
-            }
+            {"role": "system", "content": f"Today is {today}. {EXTRACTION_PROMPT}"},
+            {"role": "user", "content": user_input}
         ],
-        model="llama-3.3-70b-versatile",
-        temperature=0.5,
-        top_p=1,
+        model=EXTRACTION_MODEL,
+        temperature=0,
         stream=False,
         response_format={"type": "json_object"}
     )
+    return json.loads(chat_completion.choices[0].message.content)
+
+def shape_extraction(fields, user_input, today):
+    """Turn the model's compact reply into the dict main() works with"""
+    current_year = today[-4:]
     
-    result = json.loads(chat_completion.choices[0].message.content)
-    result["type"] = "meeting_request"
+    def full_date(value):
+        # Whatever format the backend used, hand on MM/DD/YYYY when we can read it
+        normalized = local_extraction.normalize_date(value, today)
+        if normalized:
+            return normalized
+        # Check if year is missing and add current year if needed
+        if value and re.match(r'^\d{1,2}/\d{1,2}$', value):
+            return f"{value}/{current_year}"
+        return value
     
-    # If email was found in input, add it to result
-    if found_email:
-        result["email"] = found_email.group(0)
+    if fields.get("intent") == "events":
+        result = {
+            "type": "events_query",
+            "date": full_date(fields.get("date")) or today,
+            "query_type": "specific_date"
+        }
+        end_date = full_date(fields.get("end_date"))
+        if end_date and end_date != result["date"]:
+            result["end_date"] = end_date
+        return result
     
+    people = fields.get("people") or []
     # Ensure Person is always a list
-    if "Person" in result and isinstance(result["Person"], str):
-        result["Person"] = [result["Person"]]
+    if isinstance(people, str):
+        people = [people]
+    try:
+        duration = int(fields.get("minutes") or DEFAULT_MEETING_MINUTES)
+    except (TypeError, ValueError):
+        duration = DEFAULT_MEETING_MINUTES
+    result = {
+        "type": "meeting_request",
+        "Person": people,
+        "date": full_date(fields.get("date")),
+        "time": fields.get("time"),
+        "duration": duration,
+        "summary": fields.get("summary") or "Meeting"
+    }
+    
+    # If email was found in input, use it directly
+    found_email = re.search(EMAIL_PATTERN, user_input)
+    if found_email:
+        result["email"] = found_email.group(0)
     
     return result
 
+# Longest range of days an events query shows
+MAX_EVENT_RANGE_DAYS = 14
+
+def date_range(start, end=None):
+    """Every day from start to end as MM/DD/YYYY, or just [start] if it isn't a plain range"""
+    if not end:
+        return [start]
+    try:
+        first = datetime.datetime.strptime(start.replace('-', '/'), "%m/%d/%Y").date()
+        last = datetime.datetime.strptime(end.replace('-', '/'), "%m/%d/%Y").date()
+    except (AttributeError, ValueError):
+        return [start]
+    if last < first:
+        return [start]
+    span = min((last - first).days, MAX_EVENT_RANGE_DAYS - 1)
+    return [(first + datetime.timedelta(days=i)).strftime("%m/%d/%Y") for i in range(span + 1)]
+
+class ExtractionBatcher:
+    """Merges extraction requests that arrive close together into one Groq call.
+
+    The first request of a batch waits `window` seconds for company, then
+    sends everything pending as one JSON list and hands each caller its own
+    item. A batch that fills up is sent at once. Items missing from the
+    reply are extracted on their own.
+    """
+
+    def __init__(self, window, max_batch=EXTRACTION_MAX_BATCH):
+        self.window = window
+        self.max_batch = max_batch
+        self._lock = threading.Lock()
+        self._pending = []  # (id, text, today, Future)
+        self._next_id = 0
+
+    def extract(self, user_input, today):
+        future = Future()
+        with self._lock:
+            self._next_id += 1
+            self._pending.append((str(self._next_id), user_input, today, future))
+            leader = len(self._pending) == 1
+            batch = self._take() if len(self._pending) >= self.max_batch else None
+        if batch:
+            self._send(batch)
+        elif leader:
+            time.sleep(self.window)
+            with self._lock:
+                batch = self._take()
+            if batch:
+                self._send(batch)
+        return future.result()
+
+    def _take(self):
+        batch, self._pending = self._pending, []
+        return batch
+
+    def _send(self, batch):
+        if len(batch) == 1:
+            self._send_one(batch[0])
+            return
+        items = [{"id": item_id, "today": today, "text": text} for item_id, text, today, _ in batch]
+        try:
+            # The call serves several users, so it only counts against the global quota
+            chat_completion = governor.call('groq', lambda: get_groq_client().chat.completions.create(
+                messages=[
+                    {"role": "system", "content": BATCH_EXTRACTION_PROMPT},
+                    {"role": "user", "content": json.dumps(items)}
+                ],
+                model=EXTRACTION_MODEL,
+                temperature=0,
+                stream=False,
+                response_format={"type": "json_object"}
+            ))
+            results = {
+                str(fields.get("id")): fields
+                for fields in json.loads(chat_completion.choices[0].message.content).get("results", [])
+                if isinstance(fields, dict)
+            }
+        except Exception as e:
+            for *_, future in batch:
+                future.set_exception(e)
+            return
+        for item in batch:
+            if item[0] in results:
+                item[3].set_result(results[item[0]])
+            else:
+                self._send_one(item)
+
+    def _send_one(self, item):
+        _, text, today, future = item
+        try:
+            future.set_result(extract_request(text, today))
+        except Exception as e:
+            future.set_exception(e)
+
+@st.cache_resource
+def get_extraction_batcher():
+    return ExtractionBatcher(EXTRACTION_BATCH_MS / 1000.0)
+
+# Extraction backends turn a request into the fields described by
+# EXTRACTION_FIELDS through one method, extract(user_input, today).
+# ALFIE_EXTRACTION picks one: "groq", "local" (no network, for offline use
+# and benchmarks) or "hybrid" (rules first, Groq for the rest).
+EXTRACTION_MODE = os.environ.get("ALFIE_EXTRACTION", "hybrid")
+
+class GroqExtraction:
+    """The remote model, micro-batched when EXTRACTION_BATCH_MS is set"""
+
+    def extract(self, user_input, today):
+        if EXTRACTION_BATCH_MS > 0:
+            return get_extraction_batcher().extract(user_input, today)
+        return extract_request(user_input, today)
+
+class LocalExtraction:
+    """Rules and keyword classification only; always answers, never calls out"""
+
+    def extract(self, user_input, today):
+        return local_extraction.extract(user_input, today, strict=False)
+
+class HybridExtraction:
+    """Rules for requests they read confidently, the remote model for the rest"""
+
+    def __init__(self, remote):
+        self.remote = remote
+
+    def extract(self, user_input, today):
+        fields = local_extraction.extract(user_input, today)
+        if fields is not None:
+            return fields
+        return self.remote.extract(user_input, today)
+
+EXTRACTION_BACKENDS = {
+    'groq': GroqExtraction,
+    'local': LocalExtraction,
+    'hybrid': lambda: HybridExtraction(GroqExtraction()),
+}
+
+@st.cache_resource
+def get_extraction_backend(mode):
+    if mode not in EXTRACTION_BACKENDS:
+        print(f"Unknown ALFIE_EXTRACTION {mode!r}, using hybrid")
+        mode = 'hybrid'
+    return EXTRACTION_BACKENDS[mode]()
+
+@profiling.staged('send_email')
 def send_email(to_address, body, meet_link=None):
+    import smtplib
+
     try:
         server = smtplib.SMTP('smtp.gmail.com', 587)
         subject = "Event booked"
@@ -579,7 +1163,7 @@ def apply_custom_css():
         }
         
         /* Button styling */
-        .stButton > button {
+        .stButton > button, .stLinkButton > a {
             background-color: #0066FF;
             color: white;
             border: none;
@@ -588,7 +1172,7 @@ def apply_custom_css():
             font-weight: 500;
         }
         
-        .stButton > button:hover {
+        .stButton > button:hover, .stLinkButton > a:hover {
             background-color: #0052CC;
         }
         
@@ -680,20 +1264,8 @@ def main():
     apply_custom_css()
     
     # Initialize session state
-    if 'authenticated' not in st.session_state:
-        st.session_state.authenticated = False
-    if 'user_email' not in st.session_state:
-        st.session_state.user_email = None
-    if 'calendar_service' not in st.session_state:
-        st.session_state.calendar_service = None
-    if 'contacts_service' not in st.session_state:
-        st.session_state.contacts_service = None
-    if 'contact_options' not in st.session_state:
-        st.session_state.contact_options = {}
-    if 'needs_email' not in st.session_state:
-        st.session_state.needs_email = None
-    if 'selected_contact' not in st.session_state:
-        st.session_state.selected_contact = None
+    init_session_state()
+    user = current_user()
 
     # Header with logo and navigation
     st.markdown("""
@@ -704,6 +1276,10 @@ def main():
         </div>
     """, unsafe_allow_html=True)
 
+    run = profiling.active()
+    if run is not None:
+        st.caption(f"Profiling is on ({run.mode}). Each request is saved to {profiling.PROFILE_DIR}.")
+
     if not st.session_state.authenticated:
         # Landing page content
         st.markdown('<div class="tag">Smart Meeting Scheduling</div>', unsafe_allow_html=True)
@@ -728,18 +1304,15 @@ def main():
             </div>
         """, unsafe_allow_html=True)
 
-        if st.button("Sign in with Google"):
-            try:
-                credentials = authenticate_google()
-                if credentials:
-                    st.session_state.calendar_service = build("calendar", "v3", credentials=credentials)
-                    st.session_state.contacts_service = build("people", "v1", credentials=credentials)
-                    user_info = build("oauth2", "v2", credentials=credentials).userinfo().get().execute()
-                    st.session_state.user_email = user_info['email']
-                    st.session_state.authenticated = True
-                    st.rerun()
-            except Exception as e:
-                st.error(f"Authentication failed: {e}")
+        if "code" in st.query_params and "state" in st.query_params:
+            finish_sign_in(st.query_params["state"], st.query_params["code"])
+        else:
+            url = sign_in_url()
+            # Google's consent page opens in a new tab; this session waits
+            # for that tab to come back and then signs itself in
+            st.link_button("Sign in with Google", url or "#", disabled=url is None)
+            if url:
+                wait_for_sign_in()
 
     else:
         # Main application interface after authentication
@@ -757,32 +1330,49 @@ def main():
 
             if user_input:
                 with st.spinner("Processing your request..."):
-                    response = parse_input(user_input, datetime.date.today().strftime("%m-%d-%Y"))
+                    # Look up the names we can already see while the LLM parses
+                    speculate_attendees(user_input)
+                    try:
+                        response = parse_input(user_input, datetime.date.today().strftime("%m-%d-%Y"))
+                    except BackendUnavailable as e:
+                        st.warning(f"Alfie is very busy right now, please try again in a moment. ({e})")
+                        st.stop()
                     
                     if response.get("type") == "events_query":
-                        events, _, _ = check_calendar(st.session_state.calendar_service, response.get("date"))
-                        if events:
+                        days = date_range(response.get("date"), response.get("end_date"))
+                        events_by_day = [
+                            (day, check_calendar(user.calendar_service, day, user_email=st.session_state.user_email)[0])
+                            for day in days
+                        ]
+                        if any(events for _, events in events_by_day):
                             query_type = response.get("query_type", "")
                             if query_type == "today":
                                 title = "Today's Events"
                             elif query_type == "tomorrow":
                                 title = "Tomorrow's Events"
+                            elif len(days) > 1:
+                                title = f"Events from {days[0]} to {days[-1]}"
                             else:
                                 title = f"Events on {response.get('date')}"
                             
                             st.markdown(f"### {title}")
                             
-                            for event in events:
-                                with st.expander(f"{event.get('time', 'No time')} - {event.get('event', 'No event')}", expanded=True):
-                                    st.write(f"**Time:** {event.get('time', 'No time')}")
-                                    st.write(f"**Summary:** {event.get('event', 'No event')}")
-                                    if event.get('attendees'):
-                                        st.write("**Attendees:**")
-                                        for attendee in event['attendees']:
-                                            if not attendee.get('self', False):
-                                                st.write(f"- {attendee.get('displayName', 'No name')} ({attendee.get('email', 'No email')})")
-                                    if event.get('meet_link') != 'No meet link':
-                                        st.write(f"**Meet Link:** {event.get('meet_link')}")
+                            for day, events in events_by_day:
+                                if len(days) > 1 and events:
+                                    st.markdown(f"#### {day}")
+                                for event in events:
+                                    with st.expander(f"{event.time} - {event.summary}", expanded=True):
+                                        st.write(f"**Time:** {event.time}")
+                                        st.write(f"**Summary:** {event.summary}")
+                                        guests = event.guests()
+                                        if guests:
+                                            st.write("**Attendees:**")
+                                            for guest_name, guest_email in guests:
+                                                st.write(f"- {guest_name} ({guest_email})")
+                                        if event.meet_link:
+                                            st.write(f"**Meet Link:** {event.meet_link}")
+                        elif len(days) > 1:
+                            st.info(f"No events found from {days[0]} to {days[-1]}")
                         else:
                             st.info(f"No events found for {response.get('date')}")
                     
@@ -795,6 +1385,7 @@ def main():
                         with col1:
                             st.markdown(f"**📅 Date:** {meeting_details.get('date')}")
                             st.markdown(f"**🕒 Time:** {meeting_details.get('time')}")
+                            st.markdown(f"**⏱️ Duration:** {meeting_details.get('duration', DEFAULT_MEETING_MINUTES)} min")
                         
                         with col2:
                             st.markdown(f"**👤 Person:** {meeting_details.get('Person')}")
@@ -810,8 +1401,8 @@ def main():
                             # For each name, search calendar history and display options immediately
                             contact_emails = {}
                             for name in person_names:
-                                # Use search_attendee to get options without adding to session state
-                                options = search_attendee(st.session_state.calendar_service, name)
+                                # Directory, contacts and meeting history, ranked together
+                                options = resolve_contacts(name)
                                 
                                 if options and len(options) > 0:
                                     # Show options in a dropdown instead of radio buttons
@@ -820,16 +1411,15 @@ def main():
                                     # Add a placeholder as first option
                                     contact_options[""] = "-- Select a contact --"
                                     
-                                    for email, details in options:
-                                        contact_name = details['name']
-                                        meeting_count = details['count']
-                                        contact_options[email] = f"{contact_name} ({email}) - {meeting_count} meetings"
+                                    for candidate in options:
+                                        contact_options[candidate.email] = candidate.label()
                                     
                                     selected_email = st.selectbox(
                                         f"Contact for {name}:",
                                         options=list(contact_options.keys()),
                                         format_func=lambda x: contact_options[x],
-                                        key=f"contact_{name}"
+                                        key=f"contact_{name}",
+                                        help="📧: Personal Contact | 👥: Directory | 📅: Calendar History"
                                     )
                                     
                                     if selected_email:  # Only add if a non-empty option is selected
@@ -851,11 +1441,13 @@ def main():
                         if attendees and len(attendees) == len(parse_attendees(meeting_details["Person"])):
                             if st.button("Schedule Meeting"):
                                 response = book_appointment(
-                                    st.session_state.calendar_service,
+                                    user.calendar_service,
                                     meeting_details["date"],
                                     meeting_details["time"],
                                     attendees,
-                                    meeting_details.get("summary", "Meeting")
+                                    meeting_details.get("summary", "Meeting"),
+                                    user_email=st.session_state.user_email,
+                                    duration=meeting_details.get("duration", DEFAULT_MEETING_MINUTES)
                                 )
                                 
                                 if "⚠️" in response:
@@ -886,12 +1478,12 @@ def main():
 
         with col2:
             if st.button("Sign Out"):
+                registry.close_session(st.session_state.session_handle)
+                event_store.stores.delete(st.session_state.user_email)
+                get_day_cache().drop_user(st.session_state.user_email)
                 st.session_state.authenticated = False
                 st.session_state.user_email = None
-                st.session_state.calendar_service = None
-                st.session_state.contacts_service = None
-                if os.path.exists(TOKEN_FILE):
-                    os.remove(TOKEN_FILE)
+                st.session_state.session_handle = None
                 st.rerun()
 
         # How It Works section
@@ -928,67 +1520,11 @@ def main():
             </div>
         """, unsafe_allow_html=True)
 
-def search_attendee(calendar_service, name):
-    """Search for attendee in previous calendar events within the last year"""
-    try:
-        # Calculate time range (last year)
-        now = datetime.datetime.utcnow()
-        one_year_ago = now - datetime.timedelta(days=365)
-        
-        # Get past calendar events
-        events_result = calendar_service.events().list(
-            calendarId='primary',
-            timeMin=one_year_ago.isoformat() + 'Z',
-            timeMax=now.isoformat() + 'Z',
-            maxResults=2000,
-            singleEvents=True,
-            orderBy='startTime'
-        ).execute()
-        
-        # Extract unique attendees from past events
-        past_attendees = {}  # email -> {name, count, last_date}
-        total_events_checked = 0
-        
-        for event in events_result.get('items', []):
-            total_events_checked += 1
-            event_date = event['start'].get('dateTime', event['start'].get('date'))
-            attendees = event.get('attendees', [])
-            for attendee in attendees:
-                email = attendee.get('email', '')
-                attendee_name = attendee.get('displayName', email.split('@')[0])
-                if email and name.lower() in attendee_name.lower():
-                    if email not in past_attendees:
-                        past_attendees[email] = {
-                            'name': attendee_name,
-                            'count': 1,
-                            'last_date': event_date,
-                            'events': [event['summary']]
-                        }
-                    else:
-                        past_attendees[email]['count'] += 1
-                        past_attendees[email]['events'].append(event['summary'])
-                        if event_date > past_attendees[email]['last_date']:
-                            past_attendees[email]['last_date'] = event_date
-        
-        if past_attendees:
-            # Sort by meeting frequency and recency
-            sorted_attendees = sorted(
-                past_attendees.items(),
-                key=lambda x: (x[1]['count'], x[1]['last_date']),
-                reverse=True
-            )
-            return sorted_attendees
-        
-        return []
-        
-    except Exception as e:
-        st.error(f"Error searching calendar history: {e}")
-        return []
-
 if __name__ == "__main__":
     if not os.path.exists(CREDENTIALS_FILE):
-        authenticate_google()  # This will show the UI and stop if file is missing
+        load_client_config()  # This will show the UI and stop if file is missing
         exit()
     print("Starting main function...")
-    main()
+    with profiling.capture(profile_mode(), st.session_state.get('session_handle')):
+        main()
     print("Application finished running")
@@ -0,0 +1,411 @@
+"""Per-user SQLite copy of the Google calendar.
+
+Each account gets one database file under EVENT_STORE_DIR. It is filled by
+Calendar incremental sync: the sync window is listed in full once, and after
+that only the changes since the last nextSyncToken are requested. Day views,
+upcoming events and attendee history are indexed queries against the file,
+so their cost and Alfie's memory use don't grow with the size of the
+calendar, and a restart keeps everything already synced.
+
+Like session_store, this module is imported once per server process and
+keeps one open store per recently active user.
+"""
+import contextlib
+import datetime
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from request_governor import error_status
+
+# Where the per-user databases live (read when the first store is opened)
+EVENT_STORE_DIR_ENV = "ALFIE_EVENT_STORE"
+DEFAULT_EVENT_STORE_DIR = os.path.join(".alfie", "events")
+# The synced window around now; queries outside it go back to the API
+SYNC_DAYS_BACK = 365
+SYNC_DAYS_AHEAD = 365
+# A store is re-synced in full once its window is this old, so it keeps
+# sliding forward with time
+FULL_SYNC_DAYS = 7
+MAX_OPEN_STORES = 256
+PAGE_SIZE = 2500
+# Bumped whenever SCHEMA changes; stores with another version are rebuilt
+SCHEMA_VERSION = 2
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    calendar_id TEXT NOT NULL,
+    id TEXT NOT NULL,
+    start_ts REAL NOT NULL,      -- UTC epoch seconds; all-day events at local midnight
+    end_ts REAL NOT NULL,        -- exclusive, like Google's end; never before start_ts
+    all_day INTEGER NOT NULL,
+    start_raw TEXT NOT NULL,     -- start dateTime or date as Google sent it
+    summary TEXT,
+    meet_link TEXT,
+    PRIMARY KEY (calendar_id, id)
+);
+CREATE INDEX IF NOT EXISTS events_by_start ON events (calendar_id, start_ts, end_ts);
+
+CREATE TABLE IF NOT EXISTS attendees (
+    calendar_id TEXT NOT NULL,
+    event_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    email TEXT NOT NULL,
+    name TEXT,
+    is_self INTEGER NOT NULL,
+    PRIMARY KEY (calendar_id, event_id, position)
+);
+CREATE INDEX IF NOT EXISTS attendees_by_email ON attendees (email);
+
+-- Lowercased words of attendee names and email local parts, for prefix search
+CREATE TABLE IF NOT EXISTS attendee_names (
+    name_token TEXT NOT NULL,
+    email TEXT NOT NULL,
+    PRIMARY KEY (name_token, email)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS sync_state (
+    calendar_id TEXT PRIMARY KEY,
+    sync_token TEXT,
+    window_start REAL NOT NULL,
+    window_end REAL NOT NULL,
+    full_synced_at REAL NOT NULL,
+    synced_at REAL NOT NULL
+);
+"""
+
+DROP_SCHEMA = """
+DROP TABLE IF EXISTS events;
+DROP TABLE IF EXISTS attendees;
+DROP TABLE IF EXISTS attendee_names;
+DROP TABLE IF EXISTS sync_state;
+"""
+
+
+def _rfc3339(ts):
+    return datetime.datetime.fromtimestamp(ts, datetime.timezone.utc).isoformat().replace('+00:00', 'Z')
+
+
+def name_tokens(name, email):
+    """Lowercased words of a display name and of the email's local part"""
+    words = re.split(r"[\s.\-_'+]+", f"{name or ''} {email.split('@')[0]}".lower())
+    return {word for word in words if word}
+
+
+class AttendeeStats:
+    """Someone the user has met with: how often and when last"""
+    __slots__ = ('email', 'name', 'count', 'last_date')
+
+    def __init__(self, email, name, count, last_date):
+        self.email = email
+        self.name = name
+        self.count = count
+        self.last_date = last_date
+
+
+class EventStore:
+    """One user's synced events.
+
+    All access goes through one connection guarded by a lock; sync() holds
+    a second lock so only one sync per user runs at a time.
+    """
+
+    def __init__(self, path, local_tz):
+        self.path = path
+        self.local_tz = local_tz
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        # Keep the page cache small; there may be many stores open at once
+        self._db.execute("PRAGMA cache_size=-512")
+        if self._db.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+            # The file is only a copy of the calendar, so an older layout is
+            # dropped and the next sync fills it again in full
+            self._db.executescript(DROP_SCHEMA)
+            self._db.executescript(SCHEMA)
+            self._db.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        # Longest event per calendar, which bounds how far before a range an
+        # event overlapping it can start
+        self._max_span = dict(self._db.execute(
+            "SELECT calendar_id, MAX(end_ts - start_ts) FROM events GROUP BY calendar_id").fetchall())
+
+    def _timestamp(self, when):
+        """(epoch seconds, all_day) for an event's start or end"""
+        if 'dateTime' in when:
+            value = datetime.datetime.fromisoformat(when['dateTime'].replace('Z', '+00:00'))
+            return value.timestamp(), 0
+        day = datetime.datetime.strptime(when['date'], "%Y-%m-%d")
+        return self.local_tz.localize(day).timestamp(), 1
+
+    def sync(self, calendar_service, calendar_id='primary', max_age=60):
+        """Bring the store up to date unless it synced less than max_age seconds ago.
+
+        Returns the number of changed events applied.
+        """
+        with self._sync_lock:
+            state = self._state(calendar_id)
+            now = time.time()
+            if state and now - state['synced_at'] < max_age:
+                return 0
+            if state and state['sync_token'] and now - state['full_synced_at'] < FULL_SYNC_DAYS * 86400:
+                try:
+                    return self._incremental_sync(calendar_service, calendar_id, state, now)
+                except Exception as e:
+                    # 410 Gone: the sync token expired and only a full sync helps
+                    if error_status(e) != 410:
+                        raise
+            return self._full_sync(calendar_service, calendar_id, now)
+
+    def _list_pages(self, calendar_service, calendar_id, **params):
+        """Yield every page of events().list; the last one carries nextSyncToken"""
+        page_token = None
+        while True:
+            result = calendar_service.events().list(
+                calendarId=calendar_id, singleEvents=True, maxResults=PAGE_SIZE,
+                pageToken=page_token, **params
+            ).execute()
+            yield result
+            page_token = result.get('nextPageToken')
+            if not page_token:
+                return
+
+    def _full_sync(self, calendar_service, calendar_id, now):
+        window_start = now - SYNC_DAYS_BACK * 86400
+        window_end = now + SYNC_DAYS_AHEAD * 86400
+        pages = self._list_pages(calendar_service, calendar_id,
+                                 timeMin=_rfc3339(window_start), timeMax=_rfc3339(window_end))
+        # Pages are written as they arrive so a big calendar is never held in
+        # memory all at once; readers wait on the sync lock until it's done
+        count = 0
+        for i, page in enumerate(pages):
+            items = page.get('items', [])
+            with self._transaction():
+                if i == 0:
+                    self._db.execute("DELETE FROM events WHERE calendar_id = ?", (calendar_id,))
+                    self._db.execute("DELETE FROM attendees WHERE calendar_id = ?", (calendar_id,))
+                    self._max_span.pop(calendar_id, None)
+                self._apply(calendar_id, items, fresh=True)
+                if not page.get('nextPageToken'):
+                    self._db.execute(
+                        "INSERT OR REPLACE INTO sync_state VALUES (?, ?, ?, ?, ?, ?)",
+                        (calendar_id, page.get('nextSyncToken'), window_start, window_end, now, now))
+            count += len(items)
+        return count
+
+    def _incremental_sync(self, calendar_service, calendar_id, state, now):
+        count = 0
+        for page in self._list_pages(calendar_service, calendar_id, syncToken=state['sync_token']):
+            items = page.get('items', [])
+            with self._transaction():
+                self._apply(calendar_id, items)
+                if not page.get('nextPageToken'):
+                    self._db.execute(
+                        "UPDATE sync_state SET sync_token = ?, synced_at = ? WHERE calendar_id = ?",
+                        (page.get('nextSyncToken', state['sync_token']), now, calendar_id))
+            count += len(items)
+        return count
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        with self._lock:
+            self._db.execute("BEGIN")
+            try:
+                yield
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+
+    def apply(self, calendar_id, items):
+        """Store events we already have in hand, such as one just created"""
+        with self._transaction():
+            self._apply(calendar_id, items)
+
+    def _apply(self, calendar_id, items, fresh=False):
+        """Upsert or delete events; the caller holds the lock and a transaction.
+
+        fresh means the calendar's rows were just cleared, so there is
+        nothing old to delete first.
+        """
+        removed, rows, attendee_rows, tokens = [], [], [], set()
+        max_span = self._max_span.get(calendar_id) or 0
+        for event in items:
+            event_id = event.get('id')
+            if not event_id:
+                continue
+            if not fresh:
+                removed.append((calendar_id, event_id))
+            if event.get('status') == 'cancelled' or 'start' not in event:
+                continue
+            start_ts, all_day = self._timestamp(event['start'])
+            end_ts = self._timestamp(event['end'])[0] if 'end' in event else start_ts
+            end_ts = max(end_ts, start_ts)
+            max_span = max(max_span, end_ts - start_ts)
+            rows.append((calendar_id, event_id, start_ts, end_ts, all_day,
+                         event['start'].get('dateTime', event['start'].get('date')),
+                         event.get('summary'), event.get('hangoutLink')))
+            for position, attendee in enumerate(event.get('attendees', [])):
+                email = attendee.get('email')
+                if not email:
+                    continue
+                name = attendee.get('displayName')
+                is_self = 1 if attendee.get('self') else 0
+                attendee_rows.append((calendar_id, event_id, position, email, name, is_self))
+                if not is_self:
+                    tokens.update((token, email) for token in name_tokens(name, email))
+        db = self._db
+        if removed:
+            db.executemany("DELETE FROM attendees WHERE calendar_id = ? AND event_id = ?", removed)
+            db.executemany("DELETE FROM events WHERE calendar_id = ? AND id = ?", removed)
+        db.executemany("INSERT OR REPLACE INTO events VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        db.executemany("INSERT OR REPLACE INTO attendees VALUES (?, ?, ?, ?, ?, ?)", attendee_rows)
+        db.executemany("INSERT OR IGNORE INTO attendee_names VALUES (?, ?)", tokens)
+        # Only ever grows between full syncs, which keeps it a safe bound
+        if rows:
+            self._max_span[calendar_id] = max_span
+
+    def _state(self, calendar_id):
+        with self._lock:
+            row = self._db.execute(
+                "SELECT sync_token, window_start, window_end, full_synced_at, synced_at "
+                "FROM sync_state WHERE calendar_id = ?", (calendar_id,)).fetchone()
+        if row is None:
+            return None
+        return dict(zip(('sync_token', 'window_start', 'window_end', 'full_synced_at', 'synced_at'), row))
+
+    def covers(self, calendar_id, start_ts, end_ts):
+        """True if [start_ts, end_ts) lies inside the synced window"""
+        state = self._state(calendar_id)
+        return state is not None and state['window_start'] <= start_ts and end_ts <= state['window_end']
+
+    def events_between(self, calendar_id, start_ts, end_ts, limit=None):
+        """Events overlapping [start_ts, end_ts) as API-shaped dicts, in start order.
+
+        That includes events that started earlier and are still running,
+        such as multi-day events and ones crossing midnight. All-day events
+        start at local midnight, so on any one day they come before that
+        day's timed events.
+        """
+        with self._lock:
+            # The index range stops at the longest event, so only events that
+            # could still be running at start_ts are checked against end_ts
+            earliest = start_ts - self._max_span.get(calendar_id, 0)
+            rows = self._db.execute(
+                "SELECT id, start_raw, all_day, summary, meet_link FROM events "
+                "WHERE calendar_id = ? AND start_ts >= ? AND start_ts < ? "
+                "AND (end_ts > ? OR start_ts >= ?) "
+                "ORDER BY start_ts, all_day DESC LIMIT ?",
+                (calendar_id, earliest, end_ts, start_ts, start_ts,
+                 -1 if limit is None else limit)).fetchall()
+            attendees = {}
+            for event_id, *_ in rows:
+                attendees[event_id] = self._db.execute(
+                    "SELECT email, name, is_self FROM attendees "
+                    "WHERE calendar_id = ? AND event_id = ? ORDER BY position",
+                    (calendar_id, event_id)).fetchall()
+        events = []
+        for event_id, start_raw, all_day, summary, meet_link in rows:
+            event = {
+                'id': event_id,
+                'start': {'date' if all_day else 'dateTime': start_raw},
+                'attendees': [],
+            }
+            if summary is not None:
+                event['summary'] = summary
+            if meet_link:
+                event['hangoutLink'] = meet_link
+            for email, name, is_self in attendees[event_id]:
+                attendee = {'email': email, 'self': bool(is_self)}
+                if name:
+                    attendee['displayName'] = name
+                event['attendees'].append(attendee)
+            events.append(event)
+        return events
+
+    def find_attendees(self, query, since_ts, until_ts, calendar_id='primary'):
+        """AttendeeStats for people whose name or email starts a word with query's first word"""
+        words = [word for word in re.split(r"[\s.\-_'+]+", query.lower()) if word]
+        if not words:
+            return []
+        prefix = words[0]
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT a.email, a.name, COUNT(*), MAX(e.start_ts) "
+                "FROM attendees a JOIN events e ON e.calendar_id = a.calendar_id AND e.id = a.event_id "
+                "WHERE a.email IN (SELECT email FROM attendee_names WHERE name_token >= ? AND name_token < ?) "
+                "AND a.is_self = 0 AND a.calendar_id = ? AND e.start_ts >= ? AND e.start_ts < ? "
+                "GROUP BY a.email",
+                (prefix, prefix + '\uffff', calendar_id, since_ts, until_ts)).fetchall()
+        return [
+            AttendeeStats(email, name or email.split('@')[0], count,
+                          datetime.datetime.fromtimestamp(last_ts, datetime.timezone.utc).isoformat())
+            for email, name, count, last_ts in rows
+        ]
+
+    def stats(self):
+        with self._lock:
+            events = self._db.execute("SELECT COUNT(*) FROM events").fetchone()[0]
+            attendees = self._db.execute("SELECT COUNT(*) FROM attendees").fetchone()[0]
+        return {'events': events, 'attendees': attendees}
+
+
+class EventStores:
+    """Opens each user's store on first use and keeps the most recent ones open"""
+
+    def __init__(self, max_open=MAX_OPEN_STORES):
+        self.max_open = max_open
+        self._lock = threading.Lock()
+        self._stores = OrderedDict()  # email -> EventStore
+
+    def directory(self):
+        return os.environ.get(EVENT_STORE_DIR_ENV, DEFAULT_EVENT_STORE_DIR)
+
+    def path(self, email):
+        # File names don't reveal whose calendar is inside
+        name = hashlib.sha256(email.lower().encode()).hexdigest()[:24]
+        return os.path.join(self.directory(), f"{name}.sqlite3")
+
+    def get(self, email, local_tz):
+        with self._lock:
+            store = self._stores.get(email)
+            if store is not None:
+                self._stores.move_to_end(email)
+                return store
+            os.makedirs(self.directory(), exist_ok=True)
+            store = self._stores[email] = EventStore(self.path(email), local_tz)
+            while len(self._stores) > self.max_open:
+                # Not closed here: a session may still be using it, and the
+                # connection closes once the last reference goes
+                self._stores.popitem(last=False)
+            return store
+
+    def delete(self, email):
+        """Forget email's store and remove its files, e.g. when the user signs out"""
+        with self._lock:
+            self._stores.pop(email, None)
+            path = self.path(email)
+            # A session still holding the old store keeps working on the
+            # unlinked file; the next get() starts a fresh one
+            for suffix in ('', '-wal', '-shm'):
+                try:
+                    os.remove(path + suffix)
+                except FileNotFoundError:
+                    pass
+
+    def stats(self):
+        with self._lock:
+            stores = list(self._stores.values())
+        totals = {'stores': len(stores), 'events': 0, 'attendees': 0}
+        for store in stores:
+            for key, value in store.stats().items():
+                totals[key] += value
+        return totals
+
+
+stores = EventStores()
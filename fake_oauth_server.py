@@ -0,0 +1,136 @@
+"""A stand-in for Google's OAuth endpoints, for developing and testing sign-in.
+
+Serves /auth (signs in straight away and redirects back with a code),
+/token (authorization_code and refresh_token grants, checking PKCE) and
+/userinfo. Nothing leaves the machine.
+
+Example:
+    python fake_oauth_server.py --port 8765 --email dev@example.com
+    # then, in the shell that starts Streamlit, set the printed variables
+    streamlit run app_cursor.py
+
+Add login_hint=someone@example.com to the /auth URL to sign in as someone
+else, which is handy for trying several users at once.
+"""
+import argparse
+import base64
+import hashlib
+import json
+import secrets
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlparse
+
+
+class FakeOAuthState:
+    def __init__(self, default_email):
+        self.default_email = default_email
+        self.lock = threading.Lock()
+        self.codes = {}   # code -> (email, code_challenge, scope)
+        self.tokens = {}  # access or refresh token -> email
+        self.scopes = {}  # refresh token -> scope
+
+
+def make_handler(state):
+    class Handler(BaseHTTPRequestHandler):
+        def _json(self, status, body):
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            query = {key: values[0] for key, values in parse_qs(url.query).items()}
+            if url.path == '/auth':
+                if 'redirect_uri' not in query or 'state' not in query:
+                    return self._json(400, {'error': 'invalid_request'})
+                code = secrets.token_urlsafe(16)
+                with state.lock:
+                    state.codes[code] = (query.get('login_hint') or state.default_email,
+                                         query.get('code_challenge'), query.get('scope', ''))
+                separator = '&' if '?' in query['redirect_uri'] else '?'
+                self.send_response(302)
+                self.send_header('Location', query['redirect_uri'] + separator +
+                                 urlencode({'code': code, 'state': query['state']}))
+                self.end_headers()
+            elif url.path == '/userinfo':
+                token = self.headers.get('Authorization', '').replace('Bearer ', '')
+                with state.lock:
+                    email = state.tokens.get(token)
+                if email is None:
+                    return self._json(401, {'error': 'invalid_token'})
+                self._json(200, {'email': email, 'verified_email': True})
+            else:
+                self._json(404, {'error': 'not_found'})
+
+        def do_POST(self):
+            if urlparse(self.path).path != '/token':
+                return self._json(404, {'error': 'not_found'})
+            length = int(self.headers.get('Content-Length', 0))
+            form = {key: values[0] for key, values in parse_qs(self.rfile.read(length).decode()).items()}
+            with state.lock:
+                if form.get('grant_type') == 'authorization_code':
+                    entry = state.codes.pop(form.get('code'), None)
+                    if entry is None:
+                        return self._json(400, {'error': 'invalid_grant'})
+                    email, challenge, scope = entry
+                    if challenge:
+                        digest = hashlib.sha256(form.get('code_verifier', '').encode()).digest()
+                        if base64.urlsafe_b64encode(digest).rstrip(b'=').decode() != challenge:
+                            return self._json(400, {'error': 'invalid_grant', 'error_description': 'PKCE'})
+                    refresh_token = secrets.token_urlsafe(24)
+                    state.tokens[refresh_token] = email
+                    state.scopes[refresh_token] = scope
+                elif form.get('grant_type') == 'refresh_token':
+                    refresh_token = form.get('refresh_token')
+                    email = state.tokens.get(refresh_token)
+                    if email is None:
+                        return self._json(400, {'error': 'invalid_grant'})
+                    scope = state.scopes.get(refresh_token, '')
+                else:
+                    return self._json(400, {'error': 'unsupported_grant_type'})
+                access_token = secrets.token_urlsafe(24)
+                state.tokens[access_token] = email
+            self._json(200, {
+                'access_token': access_token,
+                'refresh_token': refresh_token,
+                'expires_in': 3600,
+                'token_type': 'Bearer',
+                'scope': scope,
+            })
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def serve(port=0, email="dev@example.com"):
+    """Start the server on a background thread; returns (server, base URL)"""
+    server = ThreadingHTTPServer(('127.0.0.1', port), make_handler(FakeOAuthState(email)))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local fake of Google's OAuth endpoints")
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--email', default="dev@example.com",
+                        help="account every sign-in becomes unless /auth gets a login_hint")
+    args = parser.parse_args()
+    server, base = serve(args.port, args.email)
+    print("Fake OAuth server running. Start Alfie with:")
+    print(f"  export ALFIE_OAUTH_AUTH_URI={base}/auth")
+    print(f"  export ALFIE_OAUTH_TOKEN_URI={base}/token")
+    print(f"  export ALFIE_OAUTH_USERINFO_URI={base}/userinfo")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
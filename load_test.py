@@ -0,0 +1,609 @@
+"""Synthetic load generator for Alfie.
+
+Drives many simulated Streamlit sessions against app_cursor.py using
+Streamlit's AppTest harness. Groq, Google Calendar/People and SMTP are
+replaced by in-process fakes with a configurable latency so the numbers
+reflect the app itself rather than the network.
+
+Example:
+    python load_test.py --concurrency 1,4,16 --sessions 3 --latency-ms 25
+"""
+import argparse
+import contextlib
+import datetime
+import functools
+import itertools
+import json
+import logging
+import os
+import random
+import statistics
+import tempfile
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+import streamlit as st
+from streamlit.runtime.caching.storage.dummy_cache_storage import MemoryCacheStorageManager
+from streamlit.runtime.dataframe_source_manager import DataframeSourceManager
+from streamlit.runtime.media_file_manager import MediaFileManager
+from streamlit.runtime.memory_media_file_storage import MemoryMediaFileStorage
+from streamlit.runtime.runtime import Runtime
+from streamlit.runtime.scriptrunner.script_cache import ScriptCache
+from streamlit.runtime.secrets import Secrets
+from streamlit.testing.v1 import AppTest
+from streamlit.testing.v1.util import patch_config_options
+
+from event_store import stores as event_stores
+from request_governor import governor, single_flight
+from session_store import registry
+
+APP_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app_cursor.py")
+
+# People that show up in the fake calendar history
+KNOWN_PEOPLE = [
+    ("Alice Smith", "alice.smith@example.com"),
+    ("Bob Jones", "bob.jones@example.com"),
+    ("Carol White", "carol.white@example.com"),
+    ("Dana Lee", "dana.lee@example.com"),
+    ("Dana Kim", "dana.kim@example.com"),
+]
+
+_user_ids = itertools.count()
+
+# Simulated backend round-trip, in seconds (set from the command line)
+BACKEND_LATENCY = 0.0
+# Fraction of backend calls that fail with a 429 or 503 (set from the command line)
+BACKEND_ERROR_RATE = 0.0
+
+
+class FakeHttpError(Exception):
+    """Carries a status_code like the Groq SDK's errors do"""
+
+    def __init__(self, status_code):
+        super().__init__(f"simulated HTTP {status_code}")
+        self.status_code = status_code
+
+
+def _sleep_backend():
+    if BACKEND_LATENCY:
+        time.sleep(BACKEND_LATENCY)
+    if BACKEND_ERROR_RATE and random.random() < BACKEND_ERROR_RATE:
+        raise FakeHttpError(random.choice((429, 503)))
+
+
+def _parse_rfc3339(value):
+    return datetime.datetime.fromisoformat(value.replace('Z', '+00:00'))
+
+
+class _Request:
+    """Mimics a googleapiclient HttpRequest: the work happens on execute()"""
+
+    def __init__(self, fn, method='GET'):
+        self._fn = fn
+        self.method = method
+
+    def execute(self, *args, **kwargs):
+        _sleep_backend()
+        # Round-trip through JSON so every call allocates fresh objects, the
+        # way decoding a real HTTP response does
+        return json.loads(json.dumps(self._fn()))
+
+
+class FakeEvents:
+    def __init__(self, calendar):
+        self._calendar = calendar
+
+    def list(self, calendarId='primary', timeMin=None, timeMax=None, maxResults=250,
+             pageToken=None, syncToken=None, **kwargs):
+        def run():
+            if syncToken:
+                items, sync_token = self._calendar.changes_since(syncToken)
+            else:
+                items, sync_token = self._calendar.items_between(timeMin, timeMax), self._calendar.sync_token()
+            offset = int(pageToken or 0)
+            result = {'items': items[offset:offset + maxResults]}
+            if offset + maxResults < len(items):
+                result['nextPageToken'] = str(offset + maxResults)
+            else:
+                result['nextSyncToken'] = sync_token
+            return result
+        return _Request(run)
+
+    def insert(self, calendarId='primary', body=None, **kwargs):
+        def run():
+            event = dict(body)
+            event['id'] = f"evt{len(self._calendar.items)}"
+            event['hangoutLink'] = f"https://meet.example.com/{event['id']}"
+            self._calendar.add(event)
+            return event
+        return _Request(run, 'POST')
+
+
+@functools.lru_cache(maxsize=None)
+def _history_template(history_size):
+    """Past and upcoming events, built once and shared by every fake calendar"""
+    items = []
+    now = datetime.datetime.now(datetime.timezone.utc).replace(minute=0, second=0, microsecond=0)
+    for i in range(history_size):
+        start = now - datetime.timedelta(hours=7 * i)
+        name, email = KNOWN_PEOPLE[i % len(KNOWN_PEOPLE)]
+        other_name, other_email = KNOWN_PEOPLE[(i + 2) % len(KNOWN_PEOPLE)]
+        items.append({
+            'id': f"hist{i}",
+            'summary': f"Sync with {name.split()[0]}",
+            'start': {'dateTime': start.isoformat()},
+            'end': {'dateTime': (start + datetime.timedelta(hours=1)).isoformat()},
+            'attendees': [
+                {'email': 'me@example.com', 'self': True},
+                {'email': email, 'displayName': name},
+                {'email': other_email, 'displayName': other_name},
+            ],
+        })
+    # A couple of meetings later today and tomorrow for the events views
+    for offset in (2, 26):
+        start = now + datetime.timedelta(hours=offset)
+        items.append({
+            'id': f"upcoming{offset}",
+            'summary': "Planning",
+            'start': {'dateTime': start.isoformat()},
+            'end': {'dateTime': (start + datetime.timedelta(hours=1)).isoformat()},
+            'attendees': [{'email': KNOWN_PEOPLE[0][1], 'displayName': KNOWN_PEOPLE[0][0]}],
+            'hangoutLink': 'https://meet.example.com/planning',
+        })
+    items.sort(key=lambda e: e['start']['dateTime'])
+    return tuple(items)
+
+
+class FakeCalendarService:
+    """In-memory stand-in for build("calendar", "v3")"""
+
+    def __init__(self, history_size=500):
+        self._lock = threading.Lock()
+        # The history is shared; only events booked by this user are new objects
+        self.items = list(_history_template(history_size))
+        # Events changed since the calendar was created, for incremental sync
+        self.changes = []
+
+    def add(self, event):
+        with self._lock:
+            self.items.append(event)
+            self.items.sort(key=lambda e: e['start']['dateTime'])
+            self.changes.append(event)
+
+    def sync_token(self):
+        with self._lock:
+            return f"sync{len(self.changes)}"
+
+    def changes_since(self, sync_token):
+        with self._lock:
+            return self.changes[int(sync_token[len("sync"):]):], f"sync{len(self.changes)}"
+
+    def items_between(self, time_min, time_max):
+        lo = _parse_rfc3339(time_min) if time_min else None
+        hi = _parse_rfc3339(time_max) if time_max else None
+        with self._lock:
+            items = list(self.items)
+        result = []
+        for event in items:
+            start = _parse_rfc3339(event['start']['dateTime'])
+            if lo and start < lo:
+                continue
+            if hi and start > hi:
+                continue
+            result.append(event)
+        return result
+
+    def events(self):
+        return FakeEvents(self)
+
+
+class FakePeopleService:
+    """In-memory stand-in for build("people", "v1")"""
+
+    def _people(self):
+        return [
+            {'names': [{'displayName': name}], 'emailAddresses': [{'value': email}]}
+            for name, email in KNOWN_PEOPLE
+        ]
+
+    def people(self):
+        return self
+
+    def searchDirectoryPeople(self, **kwargs):
+        return _Request(lambda: {'people': self._people()})
+
+    def connections(self):
+        return self
+
+    def list(self, **kwargs):
+        return _Request(lambda: {'connections': self._people()})
+
+
+def _fake_extraction(text):
+    """What the model would pull out of one request"""
+    if "events" in text.lower() or "meetings" in text.lower():
+        return {'intent': 'events', 'date': datetime.date.today().strftime("%m/%d/%Y")}
+    people = []
+    for name, _ in KNOWN_PEOPLE:
+        first_name = name.split()[0]
+        if first_name in text and first_name not in people:
+            people.append(first_name)
+    tomorrow = datetime.date.today() + datetime.timedelta(days=1)
+    return {
+        'intent': 'meeting',
+        'people': people,
+        'date': tomorrow.strftime("%m/%d/%Y"),
+        'time': '2pm',
+        'minutes': 30,
+        'summary': 'Load test meeting',
+    }
+
+
+class _Completions:
+    def __init__(self):
+        self.calls = 0
+        self.items = 0
+        self._lock = threading.Lock()
+
+    def create(self, messages=None, **kwargs):
+        _sleep_backend()
+        text = messages[-1]['content']
+        if '"results"' in messages[0]['content']:
+            # A micro-batch: a JSON list of requests, answered by id
+            items = json.loads(text)
+            content = json.dumps({'results': [
+                dict(_fake_extraction(item['text']), id=item['id']) for item in items
+            ]})
+        else:
+            items = [text]
+            content = json.dumps(_fake_extraction(text))
+        with self._lock:
+            self.calls += 1
+            self.items += len(items)
+        message = mock.Mock(content=content)
+        return mock.Mock(choices=[mock.Mock(message=message)])
+
+
+# Shared by every FakeGroq, like one API key's usage
+completions = _Completions()
+
+
+class FakeGroq:
+    def __init__(self, *args, **kwargs):
+        self.chat = mock.Mock(completions=completions)
+
+
+class FakeSMTP:
+    def __init__(self, *args, **kwargs):
+        _sleep_backend()
+
+    def starttls(self):
+        pass
+
+    def login(self, *args):
+        pass
+
+    def sendmail(self, *args):
+        _sleep_backend()
+
+    def quit(self):
+        pass
+
+
+def new_account():
+    return f"user{next(_user_ids)}@example.com"
+
+
+def new_session(history_size, timeout, email=None):
+    """Create an AppTest session that is already signed in"""
+    at = AppTest.from_file(APP_FILE, default_timeout=timeout)
+    # Unless tabs of one account are being simulated, every session is a
+    # separate account so sessions don't share cached indexes in the registry
+    if email is None:
+        email = new_account()
+    handle = registry.open_session(
+        email,
+        governor.govern(FakeCalendarService(history_size), 'google', email),
+        governor.govern(FakePeopleService(), 'google', email)
+    )
+    at.session_state['authenticated'] = True
+    at.session_state['user_email'] = email
+    at.session_state['session_handle'] = handle
+    return at
+
+
+class SimulatedUser:
+    """Replays one user's clicks and typing against an AppTest session"""
+
+    def __init__(self, at, latencies):
+        self.at = at
+        self.latencies = latencies
+        # AppTest forgets format_func'd selectbox choices between runs,
+        # so every pick is re-applied before the next rerun
+        self.picks = {}
+
+    def _run(self, action=None):
+        for key, index in self.picks.items():
+            self.at.selectbox(key=key).select_index(index)
+        start = time.perf_counter()
+        if action is None:
+            self.at.run()
+        else:
+            action.run()
+        self.latencies.append(time.perf_counter() - start)
+        if self.at.exception:
+            raise RuntimeError(self.at.exception[0].value)
+
+    def open(self):
+        self._run()
+
+    def type(self, text):
+        self._run(self.at.text_input(key="user_input").input(text))
+
+    def pick(self, key, index):
+        self.picks[key] = index
+        self._run()
+
+    def click(self, label):
+        for button in self.at.button:
+            if button.label == label:
+                self._run(button.click())
+                return
+        raise RuntimeError(f"button {label!r} not rendered")
+
+
+def script_view_today(user):
+    user.open()
+    user.type("Show my events today")
+
+
+def script_book_three(user):
+    user.open()
+    user.type("Book a meeting with Alice, Bob and Carol tomorrow at 2pm")
+    for first_name in ("Alice", "Bob", "Carol"):
+        user.pick(f"contact_{first_name}", 1)
+    user.click("Schedule Meeting")
+
+
+def script_pick_contact(user):
+    user.open()
+    user.type("Set up a call with Dana tomorrow at 2pm")
+    options = user.at.selectbox(key="contact_Dana").options
+    user.pick("contact_Dana", len(options) - 1)
+    user.click("Schedule Meeting")
+
+
+SCRIPTS = {
+    'view_today': script_view_today,
+    'book_three': script_book_three,
+    'pick_contact': script_pick_contact,
+}
+
+
+@contextlib.contextmanager
+def simulated_backends():
+    """Patch in the fake backends and make AppTest safe to run from many threads"""
+    # AppTest swaps st.secrets per run, which races between threads, so the
+    # fake key is installed once for the whole process instead
+    saved_secrets = st.secrets
+    secrets = Secrets()
+    secrets._secrets = {'GROQ_API': 'load-test'}
+    st.secrets = secrets
+
+    # AppTest also installs and tears down a global mock Runtime, flips the
+    # global.appTest config option and compiles the script on every run. A
+    # real server has one Runtime, one config and one bytecode cache shared by
+    # all sessions, so the load test does the same.
+    shared_script_cache = ScriptCache()
+    shared_runtime = mock.MagicMock(spec=Runtime)
+    shared_runtime.media_file_mgr = MediaFileManager(MemoryMediaFileStorage("/mock/media"))
+    shared_runtime.dataframe_source_mgr = DataframeSourceManager()
+    shared_runtime.cache_storage_manager = MemoryCacheStorageManager()
+
+    try:
+        with mock.patch('groq.Groq', FakeGroq), mock.patch('smtplib.SMTP', FakeSMTP), \
+                mock.patch('streamlit.testing.v1.app_test.ScriptCache', lambda: shared_script_cache), \
+                mock.patch('streamlit.testing.v1.local_script_runner.ScriptCache', lambda: shared_script_cache), \
+                mock.patch.object(Runtime, 'instance', classmethod(lambda cls: shared_runtime)), \
+                mock.patch.object(Runtime, 'exists', classmethod(lambda cls: True)), \
+                patch_config_options({"global.appTest": True}), \
+                mock.patch('streamlit.testing.v1.app_test.patch_config_options',
+                           lambda options: contextlib.nullcontext()):
+            yield
+    finally:
+        st.secrets = saved_secrets
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def _run_sessions(concurrency, sessions_per_worker, script_names, history_size, timeout, tabs=1):
+    """Run every simulated user once; returns (elapsed, latencies, errors, sessions)
+
+    With tabs > 1, each group of that many workers is one account with
+    several browser tabs open, all running the same script at once.
+    """
+    latencies = []
+    errors = []
+    sessions = []
+    lock = threading.Lock()
+    accounts = {}
+
+    def account(group, i):
+        with lock:
+            if (group, i) not in accounts:
+                accounts[(group, i)] = new_account()
+            return accounts[(group, i)]
+
+    def worker(worker_id):
+        local_latencies = []
+        local_sessions = []
+        group = worker_id // tabs
+        for i in range(sessions_per_worker):
+            name = script_names[(group + i) % len(script_names)]
+            at = new_session(history_size, timeout, account(group, i) if tabs > 1 else None)
+            try:
+                SCRIPTS[name](SimulatedUser(at, local_latencies))
+            except Exception as e:
+                with lock:
+                    errors.append(f"{name}: {type(e).__name__}: {e}")
+            local_sessions.append(at)
+        with lock:
+            latencies.extend(local_latencies)
+            sessions.extend(local_sessions)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(worker, range(concurrency)))
+    return time.perf_counter() - start, latencies, errors, sessions
+
+
+def run_level(concurrency, sessions_per_worker, script_names, history_size, timeout,
+              measure_memory=True, tabs=1):
+    """Run one concurrency level and return its summary row"""
+    elapsed, latencies, errors, sessions = _run_sessions(
+        concurrency, sessions_per_worker, script_names, history_size, timeout, tabs)
+    del sessions
+    total_sessions = concurrency * sessions_per_worker
+    row = {
+        'concurrency': concurrency,
+        'sessions': total_sessions,
+        'errors': len(errors),
+        'sessions_per_s': total_sessions / elapsed if elapsed else 0.0,
+        'reruns_per_s': len(latencies) / elapsed if elapsed else 0.0,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p95_ms': percentile(latencies, 95) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+        'mean_ms': (statistics.mean(latencies) * 1000) if latencies else 0.0,
+        'retained_kb_per_session': 0.0,
+        'peak_kb_per_session': 0.0,
+    }
+
+    # tracemalloc slows every allocation down, so memory is measured in a
+    # separate pass (one session per user) rather than skewing the latencies
+    if measure_memory:
+        tracemalloc.start()
+        baseline, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        _, _, mem_errors, sessions = _run_sessions(
+            concurrency, 1, script_names, history_size, timeout, tabs)
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        del sessions
+        errors.extend(mem_errors)
+        row['errors'] = len(errors)
+        row['retained_kb_per_session'] = max(0, current - baseline) / 1024 / concurrency
+        row['peak_kb_per_session'] = max(0, peak - baseline) / 1024 / concurrency
+    return row, errors
+
+
+def print_table(rows):
+    columns = [
+        ('concurrency', 'conc', '{:>5}'),
+        ('sessions', 'sess', '{:>5}'),
+        ('errors', 'err', '{:>4}'),
+        ('sessions_per_s', 'sess/s', '{:>8.2f}'),
+        ('reruns_per_s', 'rerun/s', '{:>8.2f}'),
+        ('p50_ms', 'p50 ms', '{:>8.1f}'),
+        ('p95_ms', 'p95 ms', '{:>8.1f}'),
+        ('p99_ms', 'p99 ms', '{:>8.1f}'),
+        ('retained_kb_per_session', 'KB/sess', '{:>9.1f}'),
+        ('peak_kb_per_session', 'peak KB', '{:>9.1f}'),
+    ]
+    header = " ".join(label.rjust(len(fmt.format(0))) for _, label, fmt in columns)
+    print(header)
+    print("-" * len(header))
+    for row in rows:
+        print(" ".join(fmt.format(row[key]) for key, _, fmt in columns))
+
+
+def main():
+    global BACKEND_LATENCY, BACKEND_ERROR_RATE
+    parser = argparse.ArgumentParser(description="Simulate many concurrent Alfie users")
+    parser.add_argument('--concurrency', default='1,2,4,8',
+                        help="comma separated list of concurrent session counts")
+    parser.add_argument('--sessions', type=int, default=3,
+                        help="sessions each simulated user runs per level")
+    parser.add_argument('--scripts', default=','.join(SCRIPTS),
+                        help=f"scripts to rotate through ({', '.join(SCRIPTS)})")
+    parser.add_argument('--latency-ms', type=float, default=20.0,
+                        help="simulated round-trip for every mocked backend call")
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help="fraction of mocked backend calls that fail with 429/503")
+    parser.add_argument('--history', type=int, default=500,
+                        help="number of past events in each fake calendar")
+    parser.add_argument('--timeout', type=float, default=60.0,
+                        help="AppTest per-run timeout in seconds")
+    parser.add_argument('--tabs', type=int, default=1,
+                        help="browser tabs per account; tabs of one account run the same script together")
+    parser.add_argument('--extraction', choices=('groq', 'local', 'hybrid'), default='hybrid',
+                        help="extraction backend: remote model, local rules, or rules with a model fallback")
+    parser.add_argument('--batch-ms', type=float, default=0.0,
+                        help="merge LLM extractions arriving within this window into one call")
+    parser.add_argument('--profile', choices=('sample', 'full'),
+                        help="profile every script run; see profile_viewer.py")
+    parser.add_argument('--no-memory', action='store_true',
+                        help="skip the tracemalloc pass that measures memory per session")
+    parser.add_argument('--json', dest='json_path',
+                        help="also write the results to this file as JSON")
+    args = parser.parse_args()
+
+    BACKEND_LATENCY = args.latency_ms / 1000.0
+    BACKEND_ERROR_RATE = args.error_rate
+    os.environ['ALFIE_EXTRACTION_BATCH_MS'] = str(args.batch_ms)
+    os.environ['ALFIE_EXTRACTION'] = args.extraction
+    if args.profile:
+        os.environ['ALFIE_PROFILE'] = args.profile
+    # Every run starts with empty event stores that are removed afterwards
+    store_dir = tempfile.TemporaryDirectory(prefix="alfie-load-")
+    os.environ['ALFIE_EVENT_STORE'] = store_dir.name
+    # Streamlit warns about the app's unlabelled text input on every rerun
+    logging.disable(logging.WARNING)
+
+    levels = [int(x) for x in args.concurrency.split(',') if x.strip()]
+    script_names = [s.strip() for s in args.scripts.split(',') if s.strip()]
+    unknown = [s for s in script_names if s not in SCRIPTS]
+    if unknown:
+        parser.error(f"unknown scripts: {', '.join(unknown)}")
+
+    rows = []
+    with simulated_backends():
+        # Warm up imports, the shared bytecode cache and the fake history so
+        # the first level isn't charged for them
+        _history_template(args.history)
+        _run_sessions(1, len(script_names), script_names, args.history, args.timeout)
+        for level in levels:
+            row, errors = run_level(level, args.sessions, script_names, args.history,
+                                    args.timeout, measure_memory=not args.no_memory,
+                                    tabs=args.tabs)
+            rows.append(row)
+            for error in errors[:5]:
+                print(f"[concurrency={level}] error: {error}")
+
+    print_table(rows)
+    stats = registry.stats()
+    print(f"\nsession registry: {stats['sessions']} sessions, {stats['users']} users, "
+          f"{stats['indexes']} indexes, {stats['index_bytes'] / 1024:.1f} KB")
+    for backend, counters in governor.stats().items():
+        summary = ", ".join(f"{name} {value}" for name, value in sorted(counters.items()))
+        print(f"governor[{backend}]: {summary}")
+    print(f"groq: {completions.calls} calls for {completions.items} extractions")
+    stored = event_stores.stats()
+    print(f"event stores: {stored['stores']} open, {stored['events']} events, {stored['attendees']} attendee rows")
+    flights = single_flight.stats()
+    print(f"single flight: {flights['started']} started, {flights['shared']} shared")
+    if args.json_path:
+        with open(args.json_path, 'w') as f:
+            json.dump(rows, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,357 @@
+"""Rule-based request extraction that runs in-process on the CPU.
+
+Reads the phrasings Alfie sees most often: "show my events on Friday",
+"book a meeting with Alice and Bob tomorrow at 2pm for 30 minutes". It
+returns the same compact fields as the Groq extraction prompt:
+
+    {"intent": "events" | "meeting", "date": "MM/DD/YYYY", "end_date": ...,
+     "time": "2pm", "minutes": 30, "people": [...], "summary": "..."}
+
+In strict mode it returns None for anything it can't read with confidence
+(numbers or date words it didn't understand, ambiguous times, unclear
+intent) so the caller can ask the model instead. Nothing here touches the
+network, so it also serves as Alfie's offline and benchmark mode.
+"""
+import datetime
+import re
+
+EMAIL_PATTERN = r'[\w\.-]+@[\w\.-]+\.\w+'
+
+# Words that can follow "with" in a request but are never attendee names
+NAME_STOPWORDS = {
+    'a', 'an', 'the', 'me', 'my', 'us', 'our', 'him', 'her', 'them', 'team',
+    'meeting', 'call', 'sync', 'chat', 'please',
+    'monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday',
+    'january', 'february', 'march', 'april', 'may', 'june', 'july', 'august',
+    'september', 'october', 'november', 'december', 'am', 'pm', 'noon',
+}
+# Stopwords that may open a name clause ("with the Smiths", "with my team")
+# without hinting that the rest of it was misread
+NAME_LEADING_WORDS = {'a', 'an', 'the', 'me', 'my', 'us', 'our', 'him', 'her', 'them', 'please'}
+
+WEEKDAYS = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday']
+MONTHS = {
+    'jan': 1, 'feb': 2, 'mar': 3, 'apr': 4, 'may': 5, 'jun': 6,
+    'jul': 7, 'aug': 8, 'sep': 9, 'oct': 10, 'nov': 11, 'dec': 12,
+}
+MONTH_RE = (r'(jan(?:uary)?|feb(?:ruary)?|mar(?:ch)?|apr(?:il)?|may|june?|july?|aug(?:ust)?'
+            r'|sep(?:t(?:ember)?)?|oct(?:ober)?|nov(?:ember)?|dec(?:ember)?)\.?')
+SMALL_NUMBERS = {'a': 1, 'an': 1, 'one': 1, 'two': 2, 'three': 3, 'four': 4, 'five': 5}
+
+EVENTS_CUES = re.compile(
+    r"\b(events|meetings|agenda|calendar|what do i have|what'?s on|am i free|am i busy|show|list)\b")
+MEETING_CUES = re.compile(
+    r'\b(book|schedule|set up|setup|arrange|organi[sz]e|meet|meeting|call|sync|catch up|lunch|coffee|invite)\b')
+# Words that mean the date or time is something the rules don't cover
+# ("next month", "in the afternoon", "before Friday") when left unread
+VAGUE_WORDS = re.compile(
+    r'\b(week|weekend|month|year|next|last|previous|past|upcoming|coming|after|before|until|since'
+    r'|morning|afternoon|evening|night|early|late|end|every|daily|weekly)\b')
+RANGE_WORDS = re.compile(r'\b(from|between|through|thru|until|to|and)\b|-')
+TOPIC_RE = re.compile(
+    r'\b(?:about|regarding|re:|to discuss|discuss)\s+(.+?)'
+    r'(?=\s+(?:with|on|at|tomorrow|today|tonight|next|this|for|from|in)\b|[.?!]|$)', re.IGNORECASE)
+
+
+def parse_today(today):
+    """Alfie passes today as MM-DD-YYYY"""
+    return datetime.datetime.strptime(today.replace('/', '-'), "%m-%d-%Y").date()
+
+
+def format_date(day):
+    return day.strftime("%m/%d/%Y")
+
+
+def format_time(hour, minute):
+    """24h hour and minute as '2pm' or '2:30pm'"""
+    suffix = 'am' if hour < 12 else 'pm'
+    hour12 = hour % 12 or 12
+    return f"{hour12}{suffix}" if minute == 0 else f"{hour12}:{minute:02d}{suffix}"
+
+
+def candidate_names(user_input, strict=False):
+    """Guess attendee names from the raw request.
+
+    Takes the clause after "with", cuts it where the date, time or topic
+    starts and splits it on commas and "and". In strict mode returns None
+    when a stopword sits next to a name ("April Ludgate", "Tom May"), since
+    dropping it would leave the wrong name.
+    """
+    match = re.search(r'\bwith\b(.+)', user_input, re.IGNORECASE)
+    if not match:
+        return []
+    clause = re.split(
+        r'\b(?:at|on|tomorrow|today|tonight|next|this|around|about|for|to|from|in|by|regarding)\b|\d',
+        match.group(1), maxsplit=1, flags=re.IGNORECASE
+    )[0]
+    names = []
+    for part in re.split(r',|&|\band\b', clause, flags=re.IGNORECASE):
+        all_words = re.findall(r"[A-Za-z][A-Za-z'.-]*", part)
+        words = [w for w in all_words if w.lower() not in NAME_STOPWORDS]
+        if strict and words:
+            while all_words[0].lower() in NAME_LEADING_WORDS:
+                all_words.pop(0)
+            if len(all_words) != len(words):
+                return None
+        if 0 < len(words) <= 3:
+            name = ' '.join(words)
+            if name.lower() not in (n.lower() for n in names):
+                names.append(name)
+    return names[:5]
+
+
+def _make_date(year, month, day):
+    try:
+        return datetime.date(year, month, day)
+    except ValueError:
+        return None
+
+
+def find_dates(text, today):
+    """Every date mention in lowercased text: list of (start, end, day, vague)"""
+    found = []
+    taken = []
+
+    def add(match, day, vague=False):
+        span = match.span()
+        if any(span[0] < e and s < span[1] for s, e in taken):
+            return
+        taken.append(span)
+        found.append((span[0], span[1], day, vague))
+
+    for match in re.finditer(r'\bday after tomorrow\b', text):
+        add(match, today + datetime.timedelta(days=2))
+    for match in re.finditer(r'\b(today|tonight)\b', text):
+        add(match, today)
+    for match in re.finditer(r'\btomorrow\b', text):
+        add(match, today + datetime.timedelta(days=1))
+    for match in re.finditer(r'\bin (\d+|a|an|one|two|three|four|five) (days?|weeks?)\b', text):
+        count = int(match.group(1)) if match.group(1).isdigit() else SMALL_NUMBERS[match.group(1)]
+        add(match, today + datetime.timedelta(days=count * (7 if match.group(2).startswith('week') else 1)))
+    for match in re.finditer(r'\b(?:(this|next|coming)\s+)?(' + '|'.join(WEEKDAYS) + r')\b', text):
+        ahead = (WEEKDAYS.index(match.group(2)) - today.weekday()) % 7
+        if match.group(1) == 'next' and ahead == 0:
+            ahead = 7
+        # "next Friday" and a bare weekday naming today are read differently by different people
+        vague = match.group(1) == 'next' or (ahead == 0 and match.group(1) != 'this')
+        add(match, today + datetime.timedelta(days=ahead), vague)
+    for match in re.finditer(r'\b(\d{4})-(\d{1,2})-(\d{1,2})\b', text):
+        day = _make_date(int(match.group(1)), int(match.group(2)), int(match.group(3)))
+        add(match, day, day is None)
+    for match in re.finditer(r'\b(\d{1,2})[/-](\d{1,2})(?:[/-](\d{4}|\d{2}))?\b(?!\s*[ap]\.?m\b|:)', text):
+        year = match.group(3)
+        year = today.year if year is None else int(year) + (2000 if len(year) == 2 else 0)
+        day = _make_date(year, int(match.group(1)), int(match.group(2)))
+        add(match, day, day is None)
+    for match in re.finditer(MONTH_RE + r'\s+(\d{1,2})(?:st|nd|rd|th)?(?:,?\s*(\d{4}))?\b', text):
+        year = int(match.group(3)) if match.group(3) else today.year
+        day = _make_date(year, MONTHS[match.group(1)[:3]], int(match.group(2)))
+        add(match, day, day is None)
+    for match in re.finditer(r'\b(\d{1,2})(?:st|nd|rd|th)?\s+(?:of\s+)?' + MONTH_RE + r'(?:,?\s*(\d{4}))?\b', text):
+        year = int(match.group(3)) if match.group(3) else today.year
+        day = _make_date(year, MONTHS[match.group(2)[:3]], int(match.group(1)))
+        add(match, day, day is None)
+    for match in re.finditer(r'\b(this|next) week\b', text):
+        monday = today - datetime.timedelta(days=today.weekday())
+        if match.group(1) == 'next':
+            monday += datetime.timedelta(days=7)
+        add(match, (max(today, monday), monday + datetime.timedelta(days=6)))
+    for match in re.finditer(r'\bthis weekend\b', text):
+        sunday = today + datetime.timedelta(days=6 - today.weekday())
+        add(match, (max(today, sunday - datetime.timedelta(days=1)), sunday))
+    return sorted(found, key=lambda item: item[0])
+
+
+def find_times(text):
+    """Time mentions in lowercased text: list of (start, end, (hour, minute), minutes, vague)"""
+    found = []
+    taken = []
+
+    def add(match, hour, minute, duration=None, vague=False):
+        span = match.span()
+        if any(span[0] < e and s < span[1] for s, e in taken):
+            return
+        taken.append(span)
+        found.append((span[0], span[1], (hour, minute), duration, vague))
+
+    def to_24h(hour, meridiem):
+        return hour % 12 + (12 if meridiem == 'p' else 0)
+
+    # "2-3pm", "from 11 to 12:30pm": a start time and a length
+    for match in re.finditer(r'\b(\d{1,2})(?::([0-5]\d))?\s*(?:-|to|until)\s*(\d{1,2})(?::([0-5]\d))?\s*([ap])\.?m\.?', text):
+        end_hour = to_24h(int(match.group(3)), match.group(5))
+        end_minute = int(match.group(4) or 0)
+        start_hour = to_24h(int(match.group(1)), match.group(5))
+        if start_hour * 60 > end_hour * 60 + end_minute:
+            start_hour -= 12
+        start_minute = int(match.group(2) or 0)
+        length = end_hour * 60 + end_minute - start_hour * 60 - start_minute
+        if int(match.group(1)) <= 12 and int(match.group(3)) <= 12 and length > 0:
+            add(match, start_hour, start_minute, length)
+    for match in re.finditer(r'\b(\d{1,2})(?::([0-5]\d))?\s*([ap])\.?m\b\.?', text):
+        if 1 <= int(match.group(1)) <= 12:
+            add(match, to_24h(int(match.group(1)), match.group(3)), int(match.group(2) or 0))
+    for match in re.finditer(r'\b([01]?\d|2[0-3]):([0-5]\d)\b', text):
+        hour = int(match.group(1))
+        # "at 3:30" could be either; 8:00 to 12:59 is almost always daytime
+        add(match, hour, int(match.group(2)), vague=1 <= hour <= 7)
+    for match in re.finditer(r'\b(noon|midday|midnight)\b', text):
+        add(match, 0 if match.group(1) == 'midnight' else 12, 0)
+    for match in re.finditer(r'\bat (\d{1,2})\b', text):
+        hour = int(match.group(1))
+        if 1 <= hour <= 12:
+            # A bare hour: guess working hours, but don't trust the guess
+            add(match, hour + 12 if hour <= 7 else hour, 0, vague=True)
+    return sorted(found, key=lambda item: item[0])
+
+
+def find_duration(text):
+    """(start, end, minutes) for a meeting length in lowercased text, or None"""
+    phrases = [
+        (r'\b(?:an?|one) hour and a half\b', 90),
+        (r'\b(?:an?|one) and a half hours?\b', 90),
+        (r'\bhalf (?:an )?hour\b', 30),
+        (r'\bquarter (?:of )?(?:an )?hour\b', 15),
+        (r'\b(?:an|one) hour\b', 60),
+    ]
+    for pattern, minutes in phrases:
+        match = re.search(pattern, text)
+        if match:
+            return match.start(), match.end(), minutes
+    match = re.search(r'\b(\d+(?:\.\d+)?)\s*-?\s*(minutes?|mins?|hours?|hrs?|h)\b', text)
+    if match:
+        amount = float(match.group(1))
+        minutes = amount if match.group(2).startswith('m') else amount * 60
+        return match.start(), match.end(), int(round(minutes))
+    return None
+
+
+def classify(text):
+    """'events', 'meeting' or None when the request doesn't say clearly"""
+    events = len(EVENTS_CUES.findall(text))
+    meeting = len(MEETING_CUES.findall(text))
+    if re.search(r'\bwith\b', text):
+        meeting += 1
+    # "what meetings do I have" asks about the calendar
+    if re.search(r"\b(do i have|have i got|what|which|when|any)\b", text):
+        events += 1
+    if events > meeting:
+        return 'events'
+    if meeting > events:
+        return 'meeting'
+    return None
+
+
+def normalize_date(value, today):
+    """A date string in any format the rules read, as MM/DD/YYYY; None if it isn't one date"""
+    if not value:
+        return None
+    text = value.strip().lower()
+    dates = find_dates(text, parse_today(today))
+    if len(dates) != 1 or dates[0][3] or not isinstance(dates[0][2], datetime.date):
+        return None
+    start, end, day, _ = dates[0]
+    if text[:start].strip(' ,') or text[end:].strip(' ,.'):
+        return None
+    return format_date(day)
+
+
+def extract(user_input, today, strict=True):
+    """Extraction fields for user_input, or None if strict and the rules aren't sure"""
+    user_input = " ".join(user_input.split())
+    text = user_input.lower()
+    today_date = parse_today(today)
+    # Spans of text the rules have read; anything left over is checked for
+    # numbers or date words they didn't understand
+    consumed = []
+    vague = False
+
+    emails = re.findall(EMAIL_PATTERN, user_input)
+    text_no_email = re.sub(EMAIL_PATTERN, lambda m: ' ' * len(m.group(0)), text)
+
+    intent = classify(text_no_email)
+    if intent is None:
+        if strict:
+            return None
+        intent = 'meeting' if re.search(r'\bwith\b', text_no_email) or emails else 'events'
+
+    dates = find_dates(text_no_email, today_date)
+    for start, end, _, is_vague in dates:
+        consumed.append((start, end))
+        vague = vague or is_vague
+    first = last = None
+    if dates:
+        first = dates[0][2]
+        if isinstance(first, tuple):
+            first, last = first
+            # A meeting needs one day, not a week
+            vague = vague or intent == 'meeting'
+        if len(dates) == 2 and not isinstance(dates[1][2], tuple):
+            between = text_no_email[dates[0][1]:dates[1][0]]
+            if RANGE_WORDS.search(between) and intent == 'events':
+                last = dates[1][2]
+            else:
+                vague = True
+        elif len(dates) > 2:
+            vague = True
+
+    times = find_times(text_no_email)
+    for start, end, _, _, is_vague in times:
+        consumed.append((start, end))
+        vague = vague or is_vague
+    if intent == 'meeting' and len(times) > 1:
+        vague = True
+
+    duration = find_duration(text_no_email)
+    if duration:
+        consumed.append(duration[:2])
+
+    topic = TOPIC_RE.search(text_no_email)
+    if topic:
+        consumed.append(topic.span())
+
+    leftover = list(text_no_email)
+    for start, end in consumed:
+        leftover[start:end] = ' ' * (end - start)
+    leftover = ''.join(leftover)
+    if re.search(r'\d', leftover) or VAGUE_WORDS.search(leftover):
+        vague = True
+
+    if intent == 'events':
+        if strict and (vague or first is None and re.search(r'\b(on|for)\b', leftover)):
+            return None
+        first = first or today_date
+        fields = {'intent': 'events', 'date': format_date(first)}
+        if last and last > first:
+            fields['end_date'] = format_date(last)
+        return fields
+
+    names = candidate_names(text_no_email, strict)
+    if names is None:
+        return None
+    people = emails + names
+    if strict and (vague or not people or first is None or not times):
+        return None
+    if emails:
+        # Names in the "with" clause are often the emails' own words
+        people = emails + [name for name in candidate_names(re.sub(EMAIL_PATTERN, ' ', user_input))
+                           if name.lower() not in ' '.join(emails).lower()]
+    else:
+        # Keep the user's own capitalisation
+        people = candidate_names(user_input)
+    hour_minute = times[0][2] if times else None
+    minutes = duration[2] if duration else (times[0][3] if times else None)
+    summary = None
+    if topic:
+        summary = user_input[topic.start(1):topic.end(1)].strip()
+        summary = summary[:1].upper() + summary[1:]
+    elif people:
+        summary = "Meeting with " + ", ".join(people)
+    return {
+        'intent': 'meeting',
+        'people': people,
+        'date': format_date(first or today_date),
+        'time': format_time(*hour_minute) if hour_minute else None,
+        'minutes': minutes,
+        'summary': summary,
+    }
@@ -0,0 +1,201 @@
+"""Web-redirect Google sign-in that many users can go through at once.
+
+start() builds the Google consent URL and remembers the flow's state and
+PKCE verifier here, on the server; the session that called it keeps the
+state. The consent page opens in a new tab, and Google sends that tab back
+to the app with ?code=&state=. complete() swaps the code for tokens on an
+executor thread, and only claim(state) hands them out, so they reach the
+session that started the sign-in and no other (a forged redirect can't
+sign a victim's browser into someone else's account). Nothing waits on a
+local redirect server, so any number of sign-ins can be in progress
+together.
+
+Credentials are only kept in memory, in the user's session_store entry;
+signing in again after a restart is a single click.
+
+Building the consent URL needs nothing beyond the standard library, so the
+landing page doesn't import the Google auth libraries.
+
+Auth, token and userinfo endpoints can be pointed elsewhere with
+ALFIE_OAUTH_AUTH_URI, ALFIE_OAUTH_TOKEN_URI and ALFIE_OAUTH_USERINFO_URI,
+for example at fake_oauth_server.py during development.
+
+Like session_store, this module is imported once per server process.
+"""
+import base64
+import hashlib
+import os
+import secrets
+import threading
+import time
+from urllib.parse import urlencode, urlparse
+
+from request_governor import governor
+
+REDIRECT_URI = os.environ.get("ALFIE_OAUTH_REDIRECT_URI", "http://localhost:8501")
+USERINFO_URI = os.environ.get("ALFIE_OAUTH_USERINFO_URI", "https://www.googleapis.com/oauth2/v2/userinfo")
+# A sign-in that hasn't come back from Google by then is forgotten
+PENDING_TTL = 10 * 60
+MAX_PENDING = 10000
+
+# Google may grant scopes in a different order, or add ones granted before
+os.environ.setdefault("OAUTHLIB_RELAX_TOKEN_SCOPE", "1")
+
+
+class LoginError(Exception):
+    """Sign-in can't start, or the redirect back can't be turned into a signed-in user"""
+
+
+def client_config_with_overrides(client_config):
+    """The credentials.json contents with any endpoint overrides applied"""
+    config = {kind: dict(values) for kind, values in client_config.items()}
+    for values in config.values():
+        if os.environ.get("ALFIE_OAUTH_AUTH_URI"):
+            values["auth_uri"] = os.environ["ALFIE_OAUTH_AUTH_URI"]
+        if os.environ.get("ALFIE_OAUTH_TOKEN_URI"):
+            values["token_uri"] = os.environ["ALFIE_OAUTH_TOKEN_URI"]
+        # oauthlib insists on https, except for a token endpoint on this machine
+        if urlparse(values.get("token_uri", "")).hostname in ("localhost", "127.0.0.1"):
+            os.environ.setdefault("OAUTHLIB_INSECURE_TRANSPORT", "1")
+    return config
+
+
+def client_settings(client_config):
+    """The "web" (or "installed") section of a client config"""
+    client = client_config.get("web") or client_config.get("installed")
+    if not client or not client.get("client_id") or not client.get("auth_uri"):
+        raise LoginError("credentials.json has no OAuth client_id and auth_uri")
+    return client
+
+
+def code_challenge(code_verifier):
+    """PKCE S256 challenge for code_verifier"""
+    digest = hashlib.sha256(code_verifier.encode()).digest()
+    return base64.urlsafe_b64encode(digest).rstrip(b'=').decode()
+
+
+def fetch_email(credentials):
+    """The signed-in account's email address, from the userinfo endpoint"""
+    from google.auth.transport.requests import AuthorizedSession
+    session = AuthorizedSession(credentials)
+
+    def get():
+        response = session.get(USERINFO_URI, timeout=10)
+        response.raise_for_status()
+        return response.json()
+    return governor.call('google', get)['email']
+
+
+class PendingLogin:
+    """What we need to finish a sign-in once Google redirects back"""
+    __slots__ = ('client_config', 'scopes', 'redirect_uri', 'code_verifier', 'created_at')
+
+    def __init__(self, client_config, scopes, redirect_uri, code_verifier):
+        self.client_config = client_config
+        self.scopes = scopes
+        self.redirect_uri = redirect_uri
+        self.code_verifier = code_verifier
+        self.created_at = time.monotonic()
+
+
+class LoginManager:
+    """Server-side state for sign-ins between the redirect out and back"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = {}    # state -> PendingLogin
+        self._exchanges = {}  # state -> (started_at, Future of (credentials, email))
+
+    def start(self, client_config, scopes, redirect_uri=REDIRECT_URI):
+        """(authorization URL to send the browser to, state for claim())"""
+        client_config = client_config_with_overrides(client_config)
+        client = client_settings(client_config)
+        state = secrets.token_urlsafe(32)
+        code_verifier = secrets.token_urlsafe(64)
+        query = urlencode({
+            'response_type': 'code',
+            'client_id': client['client_id'],
+            'redirect_uri': redirect_uri,
+            'scope': ' '.join(scopes),
+            'state': state,
+            'code_challenge': code_challenge(code_verifier),
+            'code_challenge_method': 'S256',
+            # A refresh token lets the session outlive the one-hour access token
+            'access_type': 'offline',
+            'include_granted_scopes': 'true',
+            'prompt': 'select_account',
+        })
+        with self._lock:
+            self._expire()
+            self._pending[state] = PendingLogin(client_config, scopes, redirect_uri, code_verifier)
+        return f"{client['auth_uri']}?{query}", state
+
+    def complete(self, state, code, executor):
+        """Start exchanging the code from Google's redirect on executor.
+
+        Returns a Future for (credentials, email) so the redirect page can
+        report progress; the credentials are only for claim(). Reruns with
+        the same state get the same future, so a code is only ever
+        exchanged once.
+        """
+        with self._lock:
+            self._expire()
+            exchange = self._exchanges.get(state)
+            if exchange is not None:
+                return exchange[1]
+            pending = self._pending.pop(state, None)
+            if pending is None:
+                raise LoginError("This sign-in link has expired or was already used. Please sign in again.")
+            future = executor.submit(self._exchange, pending, state, code)
+            self._exchanges[state] = (time.monotonic(), future)
+            return future
+
+    def claim(self, state):
+        """Future for (credentials, email) once Google has redirected back for state, else None.
+
+        Only the session that called start() knows state.
+        """
+        with self._lock:
+            exchange = self._exchanges.get(state)
+        return exchange[1] if exchange is not None else None
+
+    def is_pending(self, state):
+        """True while state can still finish signing in: Google hasn't
+        redirected back yet and it hasn't expired, or it has and the tokens
+        are waiting for claim()."""
+        with self._lock:
+            self._expire()
+            return state in self._pending or state in self._exchanges
+
+    def forget(self, state):
+        with self._lock:
+            self._pending.pop(state, None)
+            self._exchanges.pop(state, None)
+
+    def _exchange(self, pending, state, code):
+        from google_auth_oauthlib.flow import Flow
+        flow = Flow.from_client_config(
+            pending.client_config, pending.scopes, redirect_uri=pending.redirect_uri,
+            state=state, code_verifier=pending.code_verifier)
+        governor.call('google', lambda: flow.fetch_token(code=code), idempotent=False)
+        credentials = flow.credentials
+        return credentials, fetch_email(credentials)
+
+    def _expire(self):
+        now = time.monotonic()
+        for state, pending in list(self._pending.items()):
+            if now - pending.created_at > PENDING_TTL:
+                del self._pending[state]
+        for state, (started_at, future) in list(self._exchanges.items()):
+            if future.done() and now - started_at > PENDING_TTL:
+                del self._exchanges[state]
+        # Oldest first, if a flood of abandoned sign-ins gets this far
+        while len(self._pending) > MAX_PENDING:
+            del self._pending[next(iter(self._pending))]
+
+    def stats(self):
+        with self._lock:
+            return {'pending': len(self._pending), 'exchanges': len(self._exchanges)}
+
+
+logins = LoginManager()
@@ -0,0 +1,211 @@
+"""Look at and compare the profiles Alfie saves in profiling mode.
+
+A run can be named by its id, a unique prefix of it, a path to any of its
+files, or -1 for the newest run (-2 the one before, and so on).
+
+Example:
+    python profile_viewer.py list
+    python profile_viewer.py show -1
+    python profile_viewer.py compare 20261019-101500 -1
+
+The .collapsed files can also be opened in https://www.speedscope.app or
+turned into an SVG with flamegraph.pl.
+"""
+import argparse
+import glob
+import json
+import os
+import pstats
+import sys
+from collections import Counter
+
+from profiling import PROFILE_DIR
+
+
+def load_runs(directory):
+    """Run summaries in directory, oldest first"""
+    runs = []
+    for path in glob.glob(os.path.join(directory, '*.json')):
+        try:
+            with open(path) as f:
+                summary = json.load(f)
+        except (OSError, ValueError):
+            continue
+        summary['base'] = path[:-len('.json')]
+        runs.append(summary)
+    return sorted(runs, key=lambda run: (run['started'], run['id']))
+
+
+def find_run(runs, name):
+    if name.lstrip('-').isdigit() and name.startswith('-'):
+        index = int(name)
+        if -index > len(runs):
+            sys.exit(f"only {len(runs)} runs saved")
+        return runs[index]
+    name = os.path.splitext(os.path.basename(name))[0]
+    matches = [run for run in runs if run['id'].startswith(name)]
+    if len(matches) != 1:
+        sys.exit(f"{'no' if not matches else len(matches)} runs match {name!r}")
+    return matches[0]
+
+
+def read_samples(run):
+    """collapsed stack -> sample count"""
+    samples = Counter()
+    try:
+        with open(run['base'] + '.collapsed') as f:
+            for line in f:
+                stack, _, count = line.rstrip('\n').rpartition(' ')
+                samples[stack] += int(count)
+    except OSError:
+        pass
+    return samples
+
+
+def self_ms(run, samples):
+    """Milliseconds spent in each frame itself, from the samples"""
+    totals = Counter()
+    for stack, count in samples.items():
+        totals[stack.rsplit(';', 1)[-1]] += count * run['interval_ms']
+    return totals
+
+
+def read_stats(run):
+    """(file, line, function) -> (calls, cumulative ms), if the run has a pstats dump"""
+    path = run['base'] + '.prof'
+    if not os.path.exists(path):
+        return None
+    stats = pstats.Stats(path).stats
+    # Skip the @staged wrappers, which all share one code object
+    return {key: (nc, ct * 1000) for key, (cc, nc, tt, ct, callers) in stats.items()
+            if os.path.basename(key[0]) != 'profiling.py'}
+
+
+def function_name(key):
+    filename, line, name = key
+    return f"{name} ({os.path.basename(filename)}:{line})"
+
+
+def print_rows(header, rows, align=None):
+    """A table; align has 'l' or 'r' per column, default first column left, rest right"""
+    align = align or 'l' + 'r' * (len(header) - 1)
+    widths = [max(len(str(row[i])) for row in [header] + rows) for i in range(len(header))]
+    for row in [header] + rows:
+        cells = [str(cell).ljust(width) if side == 'l' else str(cell).rjust(width)
+                 for cell, width, side in zip(row, widths, align)]
+        print("  ".join(cells).rstrip())
+    print()
+
+
+def describe(run):
+    return (f"{run['id']}  {run['label']}  {run['mode']}  wall {run['wall_ms']:.1f} ms  "
+            f"cpu {run['cpu_ms']:.1f} ms  {run['samples']} samples @ {run['interval_ms']:g} ms")
+
+
+def cmd_list(args):
+    runs = load_runs(args.dir)
+    if args.label:
+        runs = [run for run in runs if args.label in run['label']]
+    rows = [[run['id'], run['mode'], f"{run['wall_ms']:.1f}",
+             " ".join(f"{name}={stage['ms']:.0f}" for name, stage in run['stages'].items()) or run['label']]
+            for run in runs[-args.limit:]]
+    if not rows:
+        print(f"no profiles in {args.dir}")
+        return
+    print_rows(['id', 'mode', 'wall ms', 'stage ms'], rows, align='llrl')
+
+
+def cmd_show(args):
+    run = find_run(load_runs(args.dir), args.run)
+    print(describe(run))
+    if run.get('note'):
+        print(run['note'])
+    print()
+    wall = run['wall_ms'] or 1
+    print_rows(['stage', 'ms', 'calls', 'share'],
+               [[name, f"{stage['ms']:.1f}", stage['calls'], f"{stage['ms'] / wall:.0%}"]
+                for name, stage in run['stages'].items()])
+
+    samples = read_samples(run)
+    by_stage = Counter()
+    for stack, count in samples.items():
+        by_stage[stack.split(';', 1)[0] if stack.startswith('[') else '(no stage)'] += count
+    total = sum(samples.values()) or 1
+    print_rows(['sampled in', 'samples', 'share'],
+               [[name, count, f"{count / total:.0%}"] for name, count in by_stage.most_common()])
+    print_rows(['hottest frames (self)', 'ms', 'share'],
+               [[frame, f"{ms:.1f}", f"{ms / (total * run['interval_ms']):.0%}"]
+                for frame, ms in self_ms(run, samples).most_common(args.top)])
+
+    stats = read_stats(run)
+    if stats:
+        ranked = sorted(stats.items(), key=lambda item: item[1][1], reverse=True)[:args.top]
+        print_rows(['cumulative (cProfile)', 'calls', 'ms'],
+                   [[function_name(key), calls, f"{ms:.1f}"] for key, (calls, ms) in ranked])
+    print(f"flamegraph input: {run['base']}.collapsed")
+
+
+def cmd_compare(args):
+    runs = load_runs(args.dir)
+    a, b = find_run(runs, args.a), find_run(runs, args.b)
+    print(f"A  {describe(a)}")
+    print(f"B  {describe(b)}\n")
+
+    def delta(x, y):
+        return f"{y - x:+.1f}"
+
+    rows = [['wall', f"{a['wall_ms']:.1f}", f"{b['wall_ms']:.1f}", delta(a['wall_ms'], b['wall_ms'])],
+            ['cpu', f"{a['cpu_ms']:.1f}", f"{b['cpu_ms']:.1f}", delta(a['cpu_ms'], b['cpu_ms'])]]
+    for name in list(a['stages']) + [name for name in b['stages'] if name not in a['stages']]:
+        x = a['stages'].get(name, {}).get('ms', 0.0)
+        y = b['stages'].get(name, {}).get('ms', 0.0)
+        rows.append([name, f"{x:.1f}", f"{y:.1f}", delta(x, y)])
+    print_rows(['ms', 'A', 'B', 'B-A'], rows)
+
+    frames_a, frames_b = self_ms(a, read_samples(a)), self_ms(b, read_samples(b))
+    changed = sorted(set(frames_a) | set(frames_b),
+                     key=lambda frame: abs(frames_b[frame] - frames_a[frame]), reverse=True)[:args.top]
+    print_rows(['self ms by frame', 'A', 'B', 'B-A'],
+               [[frame, f"{frames_a[frame]:.1f}", f"{frames_b[frame]:.1f}", delta(frames_a[frame], frames_b[frame])]
+                for frame in changed])
+
+    stats_a, stats_b = read_stats(a), read_stats(b)
+    if stats_a and stats_b:
+        missing = (0, 0.0)
+        keys = sorted(set(stats_a) | set(stats_b),
+                      key=lambda key: abs(stats_b.get(key, missing)[1] - stats_a.get(key, missing)[1]),
+                      reverse=True)[:args.top]
+        print_rows(['cumulative ms (cProfile)', 'A calls', 'B calls', 'A', 'B', 'B-A'],
+                   [[function_name(key), stats_a.get(key, missing)[0], stats_b.get(key, missing)[0],
+                     f"{stats_a.get(key, missing)[1]:.1f}", f"{stats_b.get(key, missing)[1]:.1f}",
+                     delta(stats_a.get(key, missing)[1], stats_b.get(key, missing)[1])]
+                    for key in keys])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="List, show and compare Alfie profiles")
+    parser.add_argument('--dir', default=PROFILE_DIR, help=f"profile directory (default {PROFILE_DIR})")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    list_parser = commands.add_parser('list', help="saved runs, oldest first")
+    list_parser.add_argument('--label', help="only runs whose stages include this text")
+    list_parser.add_argument('--limit', type=int, default=30)
+    list_parser.set_defaults(func=cmd_list)
+
+    show_parser = commands.add_parser('show', help="stage times and hottest frames of one run")
+    show_parser.add_argument('run')
+    show_parser.add_argument('--top', type=int, default=15)
+    show_parser.set_defaults(func=cmd_show)
+
+    compare_parser = commands.add_parser('compare', help="what changed between two runs")
+    compare_parser.add_argument('a')
+    compare_parser.add_argument('b')
+    compare_parser.add_argument('--top', type=int, default=15)
+    compare_parser.set_defaults(func=cmd_compare)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
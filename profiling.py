@@ -0,0 +1,298 @@
+"""Opt-in profiling of single script runs, for "Alfie is slow" reports.
+
+capture() wraps one execution of app_cursor.py. While it is active a
+sampler thread records the Python stack of the script thread every
+SAMPLE_INTERVAL, and in "full" mode cProfile also traces it
+deterministically. Code marks its stages with @staged / stage(), so every
+sample is tagged with the stage it was taken in and the summary has wall
+time per stage. Work handed to the executor through bind() is sampled
+under the stage that submitted it.
+
+Each run writes to PROFILE_DIR:
+    <id>.json       summary: label, wall and CPU time, per-stage times
+    <id>.collapsed  stacks in the folded format flamegraph.pl and speedscope read
+    <id>.prof       pstats dump ("full" mode only)
+Only the newest MAX_RUNS runs are kept.
+
+profile_viewer.py lists, shows and compares runs. When nothing is being
+captured, @staged costs one context variable lookup per call.
+"""
+import contextvars
+import cProfile
+import datetime
+import functools
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+
+PROFILE_DIR = os.environ.get("ALFIE_PROFILE_DIR", os.path.join(".alfie", "profiles"))
+SAMPLE_INTERVAL = float(os.environ.get("ALFIE_PROFILE_INTERVAL_MS", "2")) / 1000
+# Older runs are deleted as new ones are saved
+MAX_RUNS = int(os.environ.get("ALFIE_PROFILE_MAX_RUNS", "200"))
+# "sample" only runs the sampler, which barely slows the run down; "full"
+# adds cProfile for exact call counts at the cost of inflated timings
+MODES = ('sample', 'full')
+MAX_DEPTH = 128
+
+# Frames outside this directory (Streamlit's script runner, the thread
+# pool's worker loop) are cut from the root of each stack
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+_current = contextvars.ContextVar('alfie_profile_run', default=None)
+
+
+def parse_mode(value):
+    """'1' or 'sample' -> 'sample', 'full' -> 'full', empty, '0' or 'off' -> None"""
+    value = (value or '').strip().lower()
+    if value in ('', '0', 'off', 'false', 'no'):
+        return None
+    return value if value in MODES else 'sample'
+
+
+# Profile every session, e.g. while reproducing a report on a dev server
+DEFAULT_MODE = parse_mode(os.environ.get("ALFIE_PROFILE"))
+# Whether visitors may switch profiling on with ?profile=; off unless the
+# server is started with ALFIE_PROFILE_QUERY=1
+ALLOW_QUERY = parse_mode(os.environ.get("ALFIE_PROFILE_QUERY")) is not None
+
+
+def _frame_name(code):
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _stack(frame):
+    """Frame names root first, starting at the outermost project frame"""
+    frames = []
+    while frame is not None and len(frames) < MAX_DEPTH:
+        frames.append(frame.f_code)
+        frame = frame.f_back
+    frames.reverse()
+    for i, code in enumerate(frames):
+        if code.co_filename.startswith(PROJECT_DIR):
+            frames = frames[i:]
+            break
+    # The stage wrappers themselves are already shown as [stage] frames
+    return [_frame_name(code) for code in frames if code.co_filename != __file__]
+
+
+class ProfileRun:
+    """Samples, stage timings and the optional cProfile of one script run"""
+
+    def __init__(self, mode, session=None):
+        self.started_at = datetime.datetime.now()
+        self.id = f"{self.started_at:%Y%m%d-%H%M%S}-{uuid.uuid4().hex[:6]}"
+        self.mode = mode
+        self.session = session
+        self.samples = Counter()  # collapsed stack -> count
+        self.stage_seconds = Counter()
+        self.stage_calls = Counter()
+        self.stages_seen = []
+        self.profiler = None
+        self.note = None
+        self.wall = self.cpu = 0.0
+        self._started = self._cpu_started = 0.0
+        self._lock = threading.Lock()
+        self._threads = {}  # thread ident -> stage stack
+        self._stop = threading.Event()
+        self._sampler = None
+
+    def enter_thread(self, stages=()):
+        with self._lock:
+            self._threads[threading.get_ident()] = list(stages)
+
+    def leave_thread(self):
+        with self._lock:
+            self._threads.pop(threading.get_ident(), None)
+
+    def stages(self):
+        with self._lock:
+            return list(self._threads.get(threading.get_ident(), ()))
+
+    def push(self, name):
+        with self._lock:
+            stack = self._threads.setdefault(threading.get_ident(), [])
+            outermost = name not in stack
+            stack.append(name)
+            if name not in self.stages_seen:
+                self.stages_seen.append(name)
+        return outermost
+
+    def pop(self, name, elapsed, outermost):
+        with self._lock:
+            stack = self._threads.get(threading.get_ident())
+            if stack:
+                stack.pop()
+            # Recursion into the same stage is only timed once
+            if outermost:
+                self.stage_seconds[name] += elapsed
+                self.stage_calls[name] += 1
+
+    def _sample(self):
+        while not self._stop.wait(SAMPLE_INTERVAL):
+            frames = sys._current_frames()
+            with self._lock:
+                threads = [(ident, tuple(stack)) for ident, stack in self._threads.items()]
+            for ident, stack in threads:
+                frame = frames.get(ident)
+                if frame is None:
+                    continue
+                path = [f"[{name}]" for name in stack] + _stack(frame)
+                self.samples[';'.join(path)] += 1
+            del frames
+
+    def start(self):
+        self.enter_thread()
+        if self.mode == 'full':
+            self.profiler = cProfile.Profile()
+            try:
+                self.profiler.enable()
+            except ValueError as e:
+                # Another session is already being traced (one tracer per
+                # process on newer Pythons); sampling still works
+                self.profiler = None
+                self.note = f"cProfile unavailable: {e}"
+        self._started = time.perf_counter()
+        self._cpu_started = time.thread_time()
+        self._sampler = threading.Thread(target=self._sample, name="alfie-profiler", daemon=True)
+        self._sampler.start()
+
+    def stop(self):
+        self.wall = time.perf_counter() - self._started
+        self.cpu = time.thread_time() - self._cpu_started
+        if self.profiler is not None:
+            self.profiler.disable()
+        self._stop.set()
+        self._sampler.join()
+        self.leave_thread()
+
+    @property
+    def label(self):
+        return '+'.join(self.stages_seen) or 'rerun'
+
+    def summary(self):
+        return {
+            'id': self.id,
+            'label': self.label,
+            'mode': self.mode,
+            'session': self.session,
+            'started': self.started_at.isoformat(timespec='milliseconds'),
+            'wall_ms': round(self.wall * 1000, 2),
+            'cpu_ms': round(self.cpu * 1000, 2),
+            'interval_ms': SAMPLE_INTERVAL * 1000,
+            'samples': sum(self.samples.values()),
+            'stages': {
+                name: {'ms': round(self.stage_seconds[name] * 1000, 2), 'calls': self.stage_calls[name]}
+                for name in self.stages_seen
+            },
+            'note': self.note,
+        }
+
+    def save(self, directory=PROFILE_DIR):
+        """Write the run's artifacts; returns the path of its summary"""
+        os.makedirs(directory, exist_ok=True)
+        base = os.path.join(directory, self.id)
+        with open(base + '.collapsed', 'w') as f:
+            for stack, count in self.samples.most_common():
+                f.write(f"{stack} {count}\n")
+        if self.profiler is not None:
+            self.profiler.dump_stats(base + '.prof')
+        with open(base + '.json', 'w') as f:
+            json.dump(self.summary(), f, indent=2)
+        prune(directory)
+        return base + '.json'
+
+
+def prune(directory=PROFILE_DIR, keep=MAX_RUNS):
+    """Delete all but the newest keep runs in directory"""
+    runs = {}
+    for name in os.listdir(directory):
+        run_id, ext = os.path.splitext(name)
+        if ext in ('.json', '.collapsed', '.prof'):
+            runs.setdefault(run_id, []).append(name)
+    # Run ids start with their timestamp, so they sort oldest first
+    for run_id in sorted(runs)[:max(0, len(runs) - keep)]:
+        for name in runs[run_id]:
+            try:
+                os.remove(os.path.join(directory, name))
+            except FileNotFoundError:
+                pass
+
+
+@contextmanager
+def capture(mode, session=None):
+    """Profile the enclosed block when mode is set; yields the run or None"""
+    if mode is None:
+        yield None
+        return
+    run = ProfileRun(mode, session)
+    token = _current.set(run)
+    run.start()
+    try:
+        yield run
+    finally:
+        # Streamlit ends runs early with st.stop() and reruns by raising,
+        # and those runs are worth keeping too
+        run.stop()
+        _current.reset(token)
+        try:
+            path = run.save()
+            print(f"Profile saved to {path} ({run.label}, {run.wall * 1000:.0f} ms)")
+        except OSError as e:
+            print(f"Could not save profile {run.id}: {e}")
+
+
+def active():
+    """The run being captured in this context, or None"""
+    return _current.get()
+
+
+@contextmanager
+def stage(name):
+    """Tag samples taken inside the block with name and time it"""
+    run = _current.get()
+    if run is None:
+        yield
+        return
+    outermost = run.push(name)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        run.pop(name, time.perf_counter() - started, outermost)
+
+
+def staged(name):
+    """Decorator form of stage()"""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if _current.get() is None:
+                return fn(*args, **kwargs)
+            with stage(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def bind(fn):
+    """fn, set up to be sampled under the caller's stages on another thread"""
+    run = _current.get()
+    if run is None:
+        return fn
+    stages = run.stages()
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        token = _current.set(run)
+        run.enter_thread(stages)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            run.leave_thread()
+            _current.reset(token)
+    return wrapper
@@ -0,0 +1,373 @@
+"""Rate limiting, retries, circuit breaking and request coalescing.
+
+Every outbound call goes through RequestGovernor.call(). It waits for a
+token from the user's bucket and the backend's global bucket, retries 429
+and 5xx responses with exponential backoff and full jitter, shares one
+upstream call between identical in-flight requests, and stops calling a
+backend that keeps failing until it has had time to recover.
+
+SingleFlight is the coalescing piece on its own, for work that is bigger
+than one HTTP call (an LLM parse, a history scan).
+
+Like session_store, this module is imported once per server process, so
+the buckets, breakers, in-flight calls and counters are shared by every
+session.
+"""
+import random
+import threading
+import time
+from collections import Counter, OrderedDict
+from concurrent.futures import Future
+
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+# HTTP methods that are safe to send again after a 5xx or a timeout
+IDEMPOTENT_METHODS = {'GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS'}
+
+# Requests per second and burst size, for the whole process and per user
+BACKEND_LIMITS = {
+    'groq': {'rate': 5.0, 'burst': 10, 'user_rate': 2.0, 'user_burst': 6},
+    'google': {'rate': 20.0, 'burst': 40, 'user_rate': 5.0, 'user_burst': 10},
+}
+MAX_RETRIES = 4
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 8.0
+# Longest a call waits for a token before giving up
+MAX_TOKEN_WAIT = 20.0
+# Consecutive failures that open a breaker, and how long it stays open
+BREAKER_THRESHOLD = 5
+BREAKER_RESET_SECONDS = 30.0
+MAX_USER_BUCKETS = 10000
+
+
+class BackendUnavailable(Exception):
+    """A call was refused locally: breaker open or no token in time"""
+
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, max_wait=MAX_TOKEN_WAIT):
+        """Take a token, sleeping if needed. Returns seconds waited, or None on timeout"""
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return waited
+                delay = (1 - self._tokens) / self.rate
+            if waited + delay > max_wait:
+                return None
+            time.sleep(delay)
+            waited += delay
+
+
+class CircuitBreaker:
+    """Opens after repeated failures; lets one trial call through after a cool-down"""
+
+    def __init__(self, threshold=BREAKER_THRESHOLD, reset_seconds=BREAKER_RESET_SECONDS):
+        self.threshold = threshold
+        self.reset_seconds = reset_seconds
+        self._failures = 0
+        self._opened_at = None
+        self._trial_running = False
+        self._trial_thread = None
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._opened_at is None:
+                return 'closed'
+            if time.monotonic() - self._opened_at >= self.reset_seconds:
+                return 'half-open'
+            return 'open'
+
+    def allow(self):
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at < self.reset_seconds or self._trial_running:
+                return False
+            self._trial_running = True
+            self._trial_thread = threading.get_ident()
+            return True
+
+    def release(self):
+        """Give up this thread's trial call without an outcome, so another can run"""
+        with self._lock:
+            if self._trial_running and self._trial_thread == threading.get_ident():
+                self._trial_running = False
+                self._trial_thread = None
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_running = False
+            self._trial_thread = None
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial_running = False
+            self._trial_thread = None
+            if self._failures >= self.threshold:
+                self._opened_at = time.monotonic()
+
+
+class SingleFlight:
+    """Runs at most one call per key at a time.
+
+    Callers that arrive while a call for the same key is running wait for it
+    and get its result (or its exception) instead of starting their own.
+    Nothing is cached: once the call finishes the next caller starts afresh.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}  # key -> Future
+        self.started = 0
+        self.shared = 0
+
+    def do(self, key, fn):
+        """Run fn() in this thread, or wait for the identical call in flight"""
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None or future.cancelled()
+            if leader:
+                future = self._calls[key] = Future()
+                self.started += 1
+            else:
+                self.shared += 1
+        if not leader:
+            return future.result()
+        try:
+            result = fn()
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            self._forget(key, future)
+
+    def submit(self, key, executor, fn):
+        """Future for fn() run on executor, or for the identical call in flight"""
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None or future.cancelled()
+            if leader:
+                future = self._calls[key] = executor.submit(fn)
+                self.started += 1
+            else:
+                self.shared += 1
+        if leader:
+            # Outside the lock: the callback runs at once if fn already finished
+            future.add_done_callback(lambda f: self._forget(key, f))
+        return future
+
+    def _forget(self, key, future):
+        with self._lock:
+            if self._calls.get(key) is future:
+                del self._calls[key]
+
+    def stats(self):
+        with self._lock:
+            return {'started': self.started, 'shared': self.shared, 'in_flight': len(self._calls)}
+
+
+def error_status(exc):
+    """HTTP status of a Groq or googleapiclient error, if it has one"""
+    status = getattr(exc, 'status_code', None)
+    if status is None and getattr(exc, 'resp', None) is not None:
+        status = getattr(exc.resp, 'status', None)
+    try:
+        return int(status) if status is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def is_retryable(exc):
+    status = error_status(exc)
+    if status is not None:
+        return status in RETRYABLE_STATUSES
+    # Connection resets and timeouts from httpx, httplib2 and the socket layer
+    return isinstance(exc, (ConnectionError, TimeoutError)) or type(exc).__name__ in (
+        'APIConnectionError', 'APITimeoutError', 'ServerNotFoundError')
+
+
+def retry_after(exc):
+    """Seconds the server asked us to wait, if it said"""
+    headers = None
+    if getattr(exc, 'response', None) is not None:
+        headers = getattr(exc.response, 'headers', None)
+    elif getattr(exc, 'resp', None) is not None:
+        headers = exc.resp
+    if not headers:
+        return None
+    try:
+        value = headers.get('retry-after') or headers.get('Retry-After')
+        return float(value) if value else None
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+class RequestGovernor:
+    def __init__(self, limits=None):
+        self.limits = limits or BACKEND_LIMITS
+        self._lock = threading.Lock()
+        self._global_buckets = {
+            backend: TokenBucket(cfg['rate'], cfg['burst']) for backend, cfg in self.limits.items()
+        }
+        self._user_buckets = OrderedDict()  # (backend, user) -> TokenBucket
+        self._breakers = {backend: CircuitBreaker() for backend in self.limits}
+        self._flights = {backend: SingleFlight() for backend in self.limits}
+        self.counters = {backend: Counter() for backend in self.limits}
+
+    def _count(self, backend, name, amount=1):
+        with self._lock:
+            self.counters[backend][name] += amount
+
+    def _user_bucket(self, backend, user):
+        with self._lock:
+            bucket = self._user_buckets.get((backend, user))
+            if bucket is None:
+                cfg = self.limits[backend]
+                bucket = self._user_buckets[(backend, user)] = TokenBucket(cfg['user_rate'], cfg['user_burst'])
+                while len(self._user_buckets) > MAX_USER_BUCKETS:
+                    self._user_buckets.popitem(last=False)
+            else:
+                self._user_buckets.move_to_end((backend, user))
+            return bucket
+
+    def call(self, backend, fn, user=None, key=None, idempotent=True):
+        """Run fn() under the backend's limits.
+
+        Callers passing the same (user, key) while an identical call is in
+        flight wait for that call's result instead of issuing their own.
+        Calls that aren't idempotent are only retried after a 429, since a
+        5xx or a timeout may have come after the server acted on them.
+        """
+        if key is None:
+            return self._execute(backend, fn, user, idempotent)
+        return self._flights[backend].do((user, key), lambda: self._execute(backend, fn, user, idempotent))
+
+    def _execute(self, backend, fn, user, idempotent=True):
+        breaker = self._breakers[backend]
+        self._count(backend, 'calls')
+        attempt = 0
+        while True:
+            if not breaker.allow():
+                self._count(backend, 'short_circuited')
+                raise BackendUnavailable(f"{backend} is failing; not calling it for a while")
+            try:
+                self._wait_for_token(backend, user)
+            except BaseException:
+                # No call was made, so there is no outcome to record; a
+                # half-open breaker must not stay reserved for this trial
+                breaker.release()
+                raise
+            try:
+                result = fn()
+            except Exception as e:
+                if not is_retryable(e):
+                    # The backend answered; it's the request that was bad
+                    breaker.record_success()
+                    raise
+                throttled = error_status(e) == 429
+                if throttled:
+                    self._count(backend, 'rate_limited')
+                    # Neither an outage nor a recovery; let the next call be the trial
+                    breaker.release()
+                else:
+                    # Throttling isn't an outage, so only 5xx and network errors trip the breaker
+                    breaker.record_failure()
+                if attempt >= MAX_RETRIES or not (idempotent or throttled):
+                    self._count(backend, 'failed')
+                    raise
+                delay = random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+                delay = max(delay, retry_after(e) or 0)
+                attempt += 1
+                self._count(backend, 'retried')
+                time.sleep(delay)
+                continue
+            except BaseException:
+                breaker.release()
+                raise
+            breaker.record_success()
+            return result
+
+    def _wait_for_token(self, backend, user):
+        buckets = [self._global_buckets[backend]]
+        if user is not None:
+            buckets.insert(0, self._user_bucket(backend, user))
+        for bucket in buckets:
+            waited = bucket.acquire()
+            if waited is None:
+                self._count(backend, 'throttled')
+                raise BackendUnavailable(f"{backend} is over its request budget; try again shortly")
+            if waited:
+                self._count(backend, 'throttled')
+
+    def govern(self, target, backend, user=None):
+        """Wrap a googleapiclient service so every execute() is governed"""
+        return GovernedResource(target, self, backend, user)
+
+    def stats(self):
+        with self._lock:
+            counters = {backend: dict(counter) for backend, counter in self.counters.items()}
+        for backend, flight in self._flights.items():
+            if flight.shared:
+                counters[backend]['coalesced'] = flight.shared
+        for backend, breaker in self._breakers.items():
+            counters[backend]['breaker'] = breaker.state
+        return counters
+
+
+class GovernedResource:
+    """Proxy over a googleapiclient resource or request.
+
+    Method calls return proxies, and execute() runs through the governor.
+    Identical GET requests from the same user are coalesced by URI, and
+    POST/PATCH requests (an event insert sending invitations) aren't
+    retried after errors that may have come after Google acted on them.
+    """
+
+    def __init__(self, target, governor, backend, user):
+        self._target = target
+        self._governor = governor
+        self._backend = backend
+        self._user = user
+
+    def __getattr__(self, name):
+        attr = getattr(self._target, name)
+        if name == 'execute':
+            return self._execute
+        if callable(attr):
+            def wrapper(*args, **kwargs):
+                return GovernedResource(attr(*args, **kwargs), self._governor, self._backend, self._user)
+            return wrapper
+        return attr
+
+    def _execute(self, *args, **kwargs):
+        request = self._target
+        method = getattr(request, 'method', 'GET')
+        key = None
+        if method == 'GET' and getattr(request, 'uri', None):
+            key = request.uri
+        return self._governor.call(
+            self._backend, lambda: request.execute(*args, **kwargs), user=self._user, key=key,
+            idempotent=method in IDEMPOTENT_METHODS)
+
+
+governor = RequestGovernor()
+# Coalesces app-level work (LLM parses, history scans) across sessions
+single_flight = SingleFlight()
@@ -0,0 +1,189 @@
+"""Process-level store for per-user Google services and derived indexes.
+
+Streamlit re-executes app_cursor.py on every rerun, so anything kept in its
+module globals is rebuilt each time, and anything kept in st.session_state
+is duplicated for every open browser tab. This module is imported once per
+server process, so sessions keep only a small handle in st.session_state and
+look the heavy objects up here.
+"""
+import sys
+import threading
+import time
+import uuid
+
+# Sessions that haven't rerun for this long are dropped
+IDLE_TIMEOUT = 30 * 60
+# Derived indexes are rebuilt after this long
+INDEX_TTL = 5 * 60
+# Budget for all derived indexes across users; least recently used users
+# lose their indexes first (their services are kept)
+MAX_INDEX_BYTES = 64 * 1024 * 1024
+# How often touch() sweeps for idle sessions
+SWEEP_INTERVAL = 60
+
+
+def approx_size(obj, seen=None):
+    """Rough deep size in bytes of containers, strings and __slots__ records"""
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, (str, bytes, int, float, bool)) or obj is None:
+        return size
+    if isinstance(obj, dict):
+        for key, value in obj.items():
+            size += approx_size(key, seen) + approx_size(value, seen)
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        for item in obj:
+            size += approx_size(item, seen)
+    else:
+        for cls in type(obj).__mro__:
+            for slot in getattr(cls, '__slots__', ()):
+                if hasattr(obj, slot):
+                    size += approx_size(getattr(obj, slot), seen)
+        if hasattr(obj, '__dict__'):
+            size += approx_size(obj.__dict__, seen)
+    return size
+
+
+class UserEntry:
+    """Everything the process keeps for one signed-in Google account"""
+    __slots__ = ('email', 'calendar_service', 'contacts_service', 'indexes',
+                 'index_bytes', 'last_seen')
+
+    def __init__(self, email, calendar_service, contacts_service):
+        self.email = email
+        self.calendar_service = calendar_service
+        self.contacts_service = contacts_service
+        # key -> (built_at, size, value)
+        self.indexes = {}
+        self.index_bytes = 0
+        self.last_seen = time.monotonic()
+
+
+class SessionRegistry:
+    """Maps session handles to shared per-user services and indexes.
+
+    Several browser sessions of the same user share one UserEntry, so the
+    Google service objects and any derived index are built once per user
+    rather than once per tab.
+    """
+
+    def __init__(self, idle_timeout=IDLE_TIMEOUT, index_ttl=INDEX_TTL,
+                 max_index_bytes=MAX_INDEX_BYTES):
+        self.idle_timeout = idle_timeout
+        self.index_ttl = index_ttl
+        self.max_index_bytes = max_index_bytes
+        self._lock = threading.RLock()
+        self._users = {}     # email -> UserEntry
+        self._sessions = {}  # handle -> [email, last_seen]
+        self._last_sweep = time.monotonic()
+
+    def open_session(self, email, calendar_service, contacts_service):
+        """Register a signed-in session and return its handle"""
+        handle = uuid.uuid4().hex
+        now = time.monotonic()
+        with self._lock:
+            entry = self._users.get(email)
+            if entry is None:
+                entry = self._users[email] = UserEntry(email, calendar_service, contacts_service)
+            else:
+                # Fresh credentials replace the old services
+                entry.calendar_service = calendar_service
+                entry.contacts_service = contacts_service
+            entry.last_seen = now
+            self._sessions[handle] = [email, now]
+        return handle
+
+    def touch(self, handle):
+        """Return the UserEntry for a session, or None if it expired"""
+        now = time.monotonic()
+        if now - self._last_sweep > SWEEP_INTERVAL:
+            self.evict_idle(now)
+        with self._lock:
+            session = self._sessions.get(handle)
+            if session is None:
+                return None
+            session[1] = now
+            entry = self._users.get(session[0])
+            if entry is not None:
+                entry.last_seen = now
+            return entry
+
+    def close_session(self, handle):
+        with self._lock:
+            session = self._sessions.pop(handle, None)
+            if session is None:
+                return
+            email = session[0]
+            if not any(s[0] == email for s in self._sessions.values()):
+                self._users.pop(email, None)
+
+    def lookup_index(self, handle, key, default=None):
+        """Return a fresh cached index without building it, or default"""
+        with self._lock:
+            session = self._sessions.get(handle)
+            entry = self._users.get(session[0]) if session else None
+            cached = entry.indexes.get(key) if entry else None
+            if cached is None or time.monotonic() - cached[0] >= self.index_ttl:
+                return default
+            return cached[2]
+
+    def has_index(self, handle, key):
+        """True if a fresh index is cached for the session's user"""
+        missing = object()
+        return self.lookup_index(handle, key, missing) is not missing
+
+    def put_index(self, handle, key, value):
+        size = approx_size(value)
+        with self._lock:
+            session = self._sessions.get(handle)
+            entry = self._users.get(session[0]) if session else None
+            if entry is None:
+                return
+            old = entry.indexes.pop(key, None)
+            if old is not None:
+                entry.index_bytes -= old[1]
+            entry.indexes[key] = (time.monotonic(), size, value)
+            entry.index_bytes += size
+            self._enforce_budget()
+
+    def _enforce_budget(self):
+        total = sum(e.index_bytes for e in self._users.values())
+        if total <= self.max_index_bytes:
+            return
+        for entry in sorted(self._users.values(), key=lambda e: e.last_seen):
+            total -= entry.index_bytes
+            entry.indexes.clear()
+            entry.index_bytes = 0
+            if total <= self.max_index_bytes:
+                break
+
+    def evict_idle(self, now=None):
+        """Drop sessions idle longer than idle_timeout and users with no sessions left"""
+        if now is None:
+            now = time.monotonic()
+        with self._lock:
+            self._last_sweep = now
+            for handle, (_, last_seen) in list(self._sessions.items()):
+                if now - last_seen > self.idle_timeout:
+                    del self._sessions[handle]
+            active = {email for email, _ in self._sessions.values()}
+            for email in list(self._users):
+                if email not in active:
+                    del self._users[email]
+
+    def stats(self):
+        """Counts and index sizes for monitoring"""
+        with self._lock:
+            return {
+                'sessions': len(self._sessions),
+                'users': len(self._users),
+                'index_bytes': sum(e.index_bytes for e in self._users.values()),
+                'indexes': sum(len(e.indexes) for e in self._users.values()),
+            }
+
+
+registry = SessionRegistry()
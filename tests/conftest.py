@@ -0,0 +1,6 @@
+import os
+import sys
+
+# The app's modules live at the top of the repo rather than in a package,
+# so plain `pytest tests` needs them on the path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
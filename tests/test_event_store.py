@@ -0,0 +1,161 @@
+import datetime
+import os
+import sqlite3
+
+import pytest
+import pytz
+
+import event_store
+from event_store import EventStore, EventStores
+
+DAY = 86400
+
+
+class StatusError(Exception):
+    def __init__(self, status_code):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+
+
+class FakeCalendar:
+    """events().list(...).execute() over a dict of events, with sync tokens"""
+
+    def __init__(self, items=()):
+        self.items = {item['id']: item for item in items}
+        self.changes = []
+        self.requests = []
+        self.expired = False
+
+    def change(self, item):
+        self.items[item['id']] = item
+        self.changes.append(item)
+
+    def events(self):
+        return self
+
+    def list(self, **params):
+        self.requests.append(params)
+        return self
+
+    def execute(self):
+        params = self.requests[-1]
+        if 'syncToken' in params:
+            if self.expired:
+                raise StatusError(410)
+            items, self.changes = self.changes, []
+        else:
+            items = [item for item in self.items.values() if item.get('status') != 'cancelled']
+            self.changes = []
+        return {'items': items, 'nextSyncToken': f"token{len(self.requests)}"}
+
+
+def at(day, hour, minute=0):
+    """RFC 3339 for hour:minute UTC, day days from today"""
+    value = datetime.datetime.now(datetime.timezone.utc).replace(
+        hour=0, minute=0, second=0, microsecond=0) + datetime.timedelta(days=day, hours=hour, minutes=minute)
+    return value.isoformat()
+
+
+def date(day):
+    return (datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(days=day)).strftime("%Y-%m-%d")
+
+
+def timed(event_id, start, end, **fields):
+    return dict({'id': event_id, 'summary': event_id, 'start': {'dateTime': start},
+                 'end': {'dateTime': end}}, **fields)
+
+
+def all_day(event_id, first, last_exclusive):
+    return {'id': event_id, 'summary': event_id, 'start': {'date': date(first)}, 'end': {'date': date(last_exclusive)}}
+
+
+def day_ids(store, day):
+    start = datetime.datetime.fromisoformat(at(day, 0)).timestamp()
+    return [event['id'] for event in store.events_between('primary', start, start + DAY)]
+
+
+@pytest.fixture
+def store(tmp_path):
+    return EventStore(str(tmp_path / 'events.sqlite3'), pytz.utc)
+
+
+def test_full_sync_and_day_query(store):
+    calendar = FakeCalendar([
+        timed('late', at(3, 15), at(3, 16)),
+        timed('early', at(3, 9), at(3, 10), attendees=[{'email': 'ann@example.com', 'displayName': 'Ann'}]),
+        all_day('holiday', 3, 4),
+        timed('other day', at(4, 9), at(4, 10)),
+    ])
+    assert store.sync(calendar) == 4
+    assert day_ids(store, 3) == ['holiday', 'early', 'late']
+    early = store.events_between('primary', 0, float('inf'), limit=2)[1]
+    assert early['attendees'] == [{'email': 'ann@example.com', 'self': False, 'displayName': 'Ann'}]
+    # Synced less than max_age ago, so nothing is requested
+    assert store.sync(calendar) == 0
+    assert len(calendar.requests) == 1
+
+
+def test_events_overlapping_the_day_are_included(store):
+    calendar = FakeCalendar([
+        all_day('trip', 1, 4),
+        timed('overnight', at(2, 22), at(3, 2)),
+        timed('ends at midnight', at(2, 23), at(3, 0)),
+        timed('starts at midnight', at(3, 0), at(3, 1)),
+        timed('reminder', at(3, 0), at(3, 0)),
+        all_day('next day', 4, 5),
+    ])
+    store.sync(calendar)
+    assert sorted(day_ids(store, 3)) == ['overnight', 'reminder', 'starts at midnight', 'trip']
+    assert day_ids(store, 4) == ['next day']
+
+
+def test_incremental_sync_applies_changes(store):
+    calendar = FakeCalendar([
+        timed('moved', at(3, 9), at(3, 10)),
+        timed('cancelled', at(3, 11), at(3, 12)),
+    ])
+    store.sync(calendar)
+    calendar.change(timed('moved', at(5, 9), at(5, 10)))
+    calendar.change({'id': 'cancelled', 'status': 'cancelled'})
+    calendar.change(all_day('new', 3, 6))
+    assert store.sync(calendar, max_age=0) == 3
+    assert calendar.requests[-1]['syncToken'] == 'token1'
+    assert day_ids(store, 3) == ['new']
+    assert day_ids(store, 5) == ['new', 'moved']
+
+
+def test_expired_sync_token_falls_back_to_full_sync(store):
+    calendar = FakeCalendar([timed('kept', at(3, 9), at(3, 10))])
+    store.sync(calendar)
+    calendar.expired = True
+    calendar.items['added'] = timed('added', at(3, 11), at(3, 12))
+    assert store.sync(calendar, max_age=0) == 2
+    assert 'syncToken' not in calendar.requests[-1]
+    assert day_ids(store, 3) == ['kept', 'added']
+
+
+def test_older_schema_is_rebuilt(tmp_path):
+    path = str(tmp_path / 'events.sqlite3')
+    db = sqlite3.connect(path)
+    db.execute("CREATE TABLE events (calendar_id TEXT, id TEXT, start_ts REAL)")
+    db.execute("CREATE TABLE sync_state (calendar_id TEXT PRIMARY KEY, sync_token TEXT, window_start REAL, "
+               "window_end REAL, full_synced_at REAL, synced_at REAL)")
+    db.execute("INSERT INTO sync_state VALUES ('primary', 'old', 0, 1e12, 1e12, 1e12)")
+    db.commit()
+    db.close()
+    store = EventStore(path, pytz.utc)
+    calendar = FakeCalendar([timed('event', at(3, 9), at(3, 10))])
+    assert store.sync(calendar) == 1
+    assert 'syncToken' not in calendar.requests[-1]
+    assert day_ids(store, 3) == ['event']
+
+
+def test_delete_removes_the_store(tmp_path, monkeypatch):
+    monkeypatch.setenv(event_store.EVENT_STORE_DIR_ENV, str(tmp_path))
+    stores = EventStores()
+    store = stores.get('ann@example.com', pytz.utc)
+    store.sync(FakeCalendar([timed('event', at(3, 9), at(3, 10))]))
+    assert os.path.exists(stores.path('ann@example.com'))
+    stores.delete('ann@example.com')
+    assert not any(os.path.exists(stores.path('ann@example.com') + suffix) for suffix in ('', '-wal', '-shm'))
+    assert stores.get('ann@example.com', pytz.utc).stats() == {'events': 0, 'attendees': 0}
@@ -0,0 +1,56 @@
+import pytest
+
+from local_extraction import candidate_names, extract
+
+# A Monday
+TODAY = '10-19-2026'
+
+
+@pytest.mark.parametrize('text, expected', [
+    ("show my events on Friday", {'intent': 'events', 'date': '10/23/2026'}),
+    ("what do I have tomorrow", {'intent': 'events', 'date': '10/20/2026'}),
+    ("show my meetings this week", {'intent': 'events', 'date': '10/19/2026', 'end_date': '10/25/2026'}),
+    ("events from 10/20 to 10/22", {'intent': 'events', 'date': '10/20/2026', 'end_date': '10/22/2026'}),
+    ("book a meeting with Alice and Bob tomorrow at 2pm for 30 minutes",
+     {'intent': 'meeting', 'people': ['Alice', 'Bob'], 'date': '10/20/2026', 'time': '2pm',
+      'minutes': 30, 'summary': 'Meeting with Alice, Bob'}),
+    ("book a meeting with Alice on Oct 21 at 14:30 for an hour",
+     {'intent': 'meeting', 'people': ['Alice'], 'date': '10/21/2026', 'time': '2:30pm',
+      'minutes': 60, 'summary': 'Meeting with Alice'}),
+    ("book a meeting with bob@example.com tomorrow at 2-3pm",
+     {'intent': 'meeting', 'people': ['bob@example.com'], 'date': '10/20/2026', 'time': '2pm',
+      'minutes': 60, 'summary': 'Meeting with bob@example.com'}),
+    ("set up a sync with Sam on Friday at 10am about the roadmap",
+     {'intent': 'meeting', 'people': ['Sam'], 'date': '10/23/2026', 'time': '10am',
+      'minutes': None, 'summary': 'The roadmap'}),
+])
+def test_reads_common_phrasings(text, expected):
+    assert extract(text, TODAY) == expected
+
+
+@pytest.mark.parametrize('text', [
+    "book a meeting with Alice next Friday at 2pm",
+    "book a meeting with Alice tomorrow at 3",
+    "show my events next month",
+    "book a meeting with Alice tomorrow",
+    "book with Bob",
+    # A month or weekday next to a name may be part of it
+    "book a meeting with April Ludgate tomorrow at 2pm",
+    "meet with Tom May tomorrow at 2pm",
+    "schedule a call with the marketing team tomorrow at 3pm",
+])
+def test_strict_mode_declines(text):
+    assert extract(text, TODAY) is None
+    assert extract(text, TODAY, strict=False) is not None
+
+
+@pytest.mark.parametrize('text, lenient, strict', [
+    ("with Alice and Bob tomorrow", ['Alice', 'Bob'], ['Alice', 'Bob']),
+    ("with the Smiths at noon", ['Smiths'], ['Smiths']),
+    ("with the team", [], []),
+    ("with April Ludgate tomorrow", ['Ludgate'], None),
+    ("with Tom May", ['Tom'], None),
+])
+def test_candidate_names(text, lenient, strict):
+    assert candidate_names(text) == lenient
+    assert candidate_names(text, strict=True) == strict
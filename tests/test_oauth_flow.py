@@ -0,0 +1,94 @@
+import http.client
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+import fake_oauth_server
+import oauth_flow
+from oauth_flow import LoginError, LoginManager
+
+SCOPES = ['openid', 'https://www.googleapis.com/auth/calendar']
+
+
+@pytest.fixture
+def google(monkeypatch):
+    """Client config pointing at a fake OAuth server, which signs everyone in as ann@example.com"""
+    server, base = fake_oauth_server.serve(email='ann@example.com')
+    monkeypatch.setenv('OAUTHLIB_INSECURE_TRANSPORT', '1')
+    monkeypatch.setattr(oauth_flow, 'USERINFO_URI', f"{base}/userinfo")
+    yield {'web': {'client_id': 'alfie', 'client_secret': 'secret',
+                   'auth_uri': f"{base}/auth", 'token_uri': f"{base}/token"}}
+    server.shutdown()
+
+
+@pytest.fixture
+def executor():
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        yield executor
+
+
+def consent(url):
+    """Visit the consent URL like a browser would; returns the redirect's query"""
+    parts = urlparse(url)
+    connection = http.client.HTTPConnection(parts.netloc, timeout=10)
+    connection.request('GET', f"{parts.path}?{parts.query}")
+    response = connection.getresponse()
+    assert response.status == 302
+    location = urlparse(response.getheader('Location'))
+    connection.close()
+    assert location.netloc == urlparse(oauth_flow.REDIRECT_URI).netloc
+    return {key: values[0] for key, values in parse_qs(location.query).items()}
+
+
+def test_sign_in_round_trip(google, executor):
+    logins = LoginManager()
+    url, state = logins.start(google, SCOPES)
+    assert logins.is_pending(state)
+    assert logins.claim(state) is None
+
+    redirect = consent(url)
+    assert redirect['state'] == state
+    future = logins.complete(state, redirect['code'], executor)
+    # The redirect tab may rerun; the code is still only exchanged once
+    assert logins.complete(state, redirect['code'], executor) is future
+    credentials, email = future.result(timeout=10)
+    assert email == 'ann@example.com'
+    assert credentials.refresh_token
+
+    assert logins.is_pending(state)
+    assert logins.claim(state) is future
+    logins.forget(state)
+    assert not logins.is_pending(state)
+    assert logins.claim(state) is None
+
+
+def test_forged_state_is_refused(google, executor):
+    logins = LoginManager()
+    url, state = logins.start(google, SCOPES)
+    redirect = consent(url)
+    with pytest.raises(LoginError):
+        logins.complete('forged', redirect['code'], executor)
+    assert logins.claim('forged') is None
+    # The real sign-in is untouched
+    assert logins.is_pending(state)
+    assert logins.claim(state) is None
+
+
+def test_used_state_is_refused(google, executor):
+    logins = LoginManager()
+    url, state = logins.start(google, SCOPES)
+    redirect = consent(url)
+    logins.complete(state, redirect['code'], executor).result(timeout=10)
+    logins.forget(state)
+    with pytest.raises(LoginError):
+        logins.complete(state, redirect['code'], executor)
+
+
+def test_expired_state(google, executor, monkeypatch):
+    logins = LoginManager()
+    url, state = logins.start(google, SCOPES)
+    monkeypatch.setattr(oauth_flow, 'PENDING_TTL', -1)
+    assert not logins.is_pending(state)
+    with pytest.raises(LoginError):
+        logins.complete(state, consent(url)['code'], executor)
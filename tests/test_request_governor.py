@@ -0,0 +1,115 @@
+import pytest
+
+import request_governor
+from request_governor import BackendUnavailable, CircuitBreaker, RequestGovernor
+
+
+def make_governor(monkeypatch, user_rate=1000.0, user_burst=1000):
+    monkeypatch.setattr(request_governor, 'MAX_RETRIES', 0)
+    governor = RequestGovernor({
+        'test': {'rate': 1000.0, 'burst': 1000, 'user_rate': user_rate, 'user_burst': user_burst},
+    })
+    # Opens on the first failure and goes half-open straight away
+    governor._breakers['test'] = CircuitBreaker(threshold=1, reset_seconds=0.0)
+    return governor
+
+
+def fail():
+    raise ConnectionError("backend down")
+
+
+def open_breaker(governor):
+    with pytest.raises(ConnectionError):
+        governor.call('test', fail)
+    assert governor._breakers['test'].state == 'half-open'
+
+
+def test_half_open_trial_success_closes_breaker(monkeypatch):
+    governor = make_governor(monkeypatch)
+    open_breaker(governor)
+    assert governor.call('test', lambda: 'ok') == 'ok'
+    assert governor._breakers['test'].state == 'closed'
+
+
+def test_half_open_trial_failure_reopens_breaker(monkeypatch):
+    governor = make_governor(monkeypatch)
+    open_breaker(governor)
+    governor._breakers['test'].reset_seconds = 60.0
+    governor._breakers['test']._opened_at -= 60.0
+    with pytest.raises(ConnectionError):
+        governor.call('test', fail)
+    assert governor._breakers['test'].state == 'open'
+    with pytest.raises(BackendUnavailable):
+        governor.call('test', lambda: 'ok')
+
+
+def test_half_open_trial_released_when_no_token(monkeypatch):
+    # One token per user, refilled far slower than MAX_TOKEN_WAIT
+    governor = make_governor(monkeypatch, user_rate=0.001, user_burst=1)
+    assert governor.call('test', lambda: 'ok', user='alice') == 'ok'
+    open_breaker(governor)
+    # The trial is granted, then refused locally before any call is made
+    with pytest.raises(BackendUnavailable):
+        governor.call('test', lambda: 'ok', user='alice')
+    assert governor.call('test', lambda: 'ok') == 'ok'
+    assert governor._breakers['test'].state == 'closed'
+
+
+def test_half_open_trial_released_on_base_exception(monkeypatch):
+    governor = make_governor(monkeypatch)
+    open_breaker(governor)
+
+    def interrupted():
+        raise KeyboardInterrupt
+
+    with pytest.raises(KeyboardInterrupt):
+        governor.call('test', interrupted)
+    assert governor.call('test', lambda: 'ok') == 'ok'
+
+
+class StatusError(Exception):
+    def __init__(self, status_code):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+
+
+def flaky(statuses):
+    """fn that raises each status in turn, then returns 'ok'; counts its calls"""
+    remaining = list(statuses)
+
+    def fn():
+        fn.calls += 1
+        if remaining:
+            raise StatusError(remaining.pop(0))
+        return 'ok'
+    fn.calls = 0
+    return fn
+
+
+def test_non_idempotent_call_not_retried_after_5xx(monkeypatch):
+    governor = make_governor(monkeypatch)
+    monkeypatch.setattr(request_governor, 'MAX_RETRIES', 3)
+    monkeypatch.setattr(request_governor, 'BACKOFF_BASE', 0.0)
+    governor._breakers['test'] = CircuitBreaker()
+    fn = flaky([503])
+    with pytest.raises(StatusError):
+        governor.call('test', fn, idempotent=False)
+    assert fn.calls == 1
+    # A 429 means the request wasn't processed, so it is safe to resend
+    fn = flaky([429])
+    assert governor.call('test', fn, idempotent=False) == 'ok'
+    assert fn.calls == 2
+    fn = flaky([503])
+    assert governor.call('test', fn) == 'ok'
+    assert fn.calls == 2
+
+
+def test_half_open_trial_released_on_429(monkeypatch):
+    governor = make_governor(monkeypatch)
+    open_breaker(governor)
+    fn = flaky([429])
+    with pytest.raises(StatusError):
+        governor.call('test', fn)
+    assert governor._breakers['test'].state == 'half-open'
+    assert governor.call('test', fn) == 'ok'
+    assert governor._breakers['test'].state == 'closed'